@@ -1,46 +1,198 @@
-from collections import OrderedDict
 from typing import Iterable, List, Generator
 
+from config import MAX_READAHEAD_PAGES
 from diskmanager import DiskManager
 from catalog import Page, ShadowPage
 
+
+class _LRUNode:
+    """Entry in one of the page lists of the buffer."""
+    __slots__ = ('prev', 'next', 'key', 'value', 'is_hot')
+
+    def __init__(self, key=None, value=None):
+        self.prev: _LRUNode = self
+        self.next: _LRUNode = self
+        self.key = key
+        self.value = value
+        self.is_hot = False  # True when the node is in the hot (Am) list
+
+
+class _PageList:
+    """Doubly linked list with a single sentinel: head.next is the front (most recent), head.prev the back."""
+    __slots__ = ('head', 'length')
+
+    def __init__(self):
+        self.head = _LRUNode()
+        self.length = 0
+
+    def unlink(self, node: _LRUNode) -> None:
+        node.prev.next = node.next
+        node.next.prev = node.prev
+        self.length -= 1
+
+    def push_front(self, node: _LRUNode) -> None:
+        head = self.head
+        node.prev = head
+        node.next = head.next
+        head.next.prev = node
+        head.next = node
+        self.length += 1
+
+    def back(self) -> _LRUNode:
+        return self.head.prev
+
+
 class BufferManager:
+    """Page cache with a 2Q replacement policy.
+
+    A page that enters the buffer is put in the FIFO probation list (A1). Only when it is accessed
+    again it is promoted to the LRU hot list (Am). Victims are taken from the back of A1 as long as
+    A1 holds more than its share of the capacity, so a single large scan can only push out other
+    scanned pages and not the working set in Am."""
 
     def __init__(self,  diskmanager: DiskManager, capacity: int = 10):
-        self.buffer = OrderedDict()
+        self.buffer: dict[int, Page | ShadowPage] = {}  # page_id: page
         self.capacity = capacity
         self.diskmanager = diskmanager
-    
+        self._nodes: dict[int, _LRUNode] = {}  # page_id: node in A1 or Am
+        self._a1 = _PageList()
+        self._am = _PageList()
+        self._a1_target = max(1, capacity // 4)
+        # pinned pages are never evicted, they are not in A1/Am and do not count towards the capacity
+        self._pinned: dict[int, Page | ShadowPage] = {}
+        # page_ids of buffered pages that are dirty or can still become dirty (shadow pages), so flush
+        # does not have to visit every page in the buffer
+        self._dirty: set[int] = set()
+        # sequential read detection for readahead
+        self._last_read_pid = -1
+        self._sequential_run = 0
+        self._readahead_until = -1
+
+    def _touch(self, node: _LRUNode) -> None:
+        """Register a repeated access: move the node to the front of Am"""
+        if node.is_hot:
+            if node is self._am.head.next:
+                return
+            self._am.unlink(node)
+        else:
+            self._a1.unlink(node)
+            node.is_hot = True
+        self._am.push_front(node)
+
     def get_pages(self, page_ids: Iterable[int]):
         """If multiple pages are needed then first yield the pages that are in the buffer. Only afterwards read from disk.
-        Otherwise pages might be evicted from the cache that are needed for the same query."""
+        Otherwise pages might be evicted from the cache that are needed for the same query.
+        The misses are announced to the disk manager up front so they can be read ahead while
+        the cached pages are being consumed, and are read in page_id order so the reads are as
+        sequential as possible. The pages are therefore not yielded in the order they were requested.
+        Every page is yielded once, also when its page_id is requested more than once."""
+        in_buffer = []
         needed_from_disk = []
-        for page_id in page_ids:
+        for page_id in dict.fromkeys(page_ids):
             if page_id in self.buffer:
-                yield self.get_page(page_id)
+                in_buffer.append(page_id)
             else:
                 needed_from_disk.append(page_id)
+        if len(needed_from_disk) > 1:
+            needed_from_disk.sort()
+            self.diskmanager.prefetch(needed_from_disk)
+        for page_id in in_buffer:
+            yield self.get_page(page_id)
         for disk_page_info in needed_from_disk:
             yield self.get_page(disk_page_info)
 
     def get_page(self, page_id: int) -> Page | ShadowPage:
         """Retrieve a page from cache or disk"""
-        if page_id not in self.buffer:
+        node = self._nodes.get(page_id)
+        if node is None:
+            pinned = self._pinned.get(page_id)
+            if pinned is not None:
+                return pinned
+            self._readahead(page_id)
             page = self.diskmanager.read_page(page_id)
             self.put(page)
             return page
-        self.buffer.move_to_end(page_id)
-        return self.buffer[page_id]
+        self._touch(node)
+        return node.value
+
+    def _readahead(self, page_id: int) -> None:
+        """Detect sequential disk reads. After more than two consecutive page_ids have been read the
+        following pages are prefetched, the window doubles with the length of the run."""
+        if page_id == self._last_read_pid + 1:
+            self._sequential_run += 1
+        else:
+            self._sequential_run = 0
+        self._last_read_pid = page_id
+        if self._sequential_run > 2 and page_id >= self._readahead_until:
+            window = min(2 ** self._sequential_run, MAX_READAHEAD_PAGES)
+            self.diskmanager.prefetch(range(page_id + 1, page_id + 1 + window))
+            self._readahead_until = page_id + window
+
+    def pin(self, page_id: int) -> Page | ShadowPage:
+        """Keep the page in the buffer until it is unpinned. Access to a pinned page skips all
+        replacement bookkeeping, use it for pages that are hit all the time like the catalog."""
+        page = self._pinned.get(page_id)
+        if page is not None:
+            return page
+        node = self._nodes.pop(page_id, None)
+        if node is not None:
+            (self._am if node.is_hot else self._a1).unlink(node)
+            page = node.value
+        else:
+            page = self.diskmanager.read_page(page_id)
+            self.buffer[page_id] = page
+        self._pinned[page_id] = page
+        return page
+
+    def unpin(self, page_id: int) -> None:
+        """Hand the page back to the replacement policy"""
+        page = self._pinned.pop(page_id)
+        del self.buffer[page_id]
+        self.put(page)
 
     def put(self, page: Page | ShadowPage) -> None:
-        self.buffer[page.page_id] = page
-        self.buffer.move_to_end(page.page_id)
-        if len(self.buffer) > self.capacity:
-            _, evicted_page = self.buffer.popitem(last = False)
-            if evicted_page.is_dirty:
-                self.diskmanager.write_page(evicted_page)
+        page_id = page.page_id
+        if page.is_dirty or isinstance(page, ShadowPage):
+            self._dirty.add(page_id)
+        else:
+            self._dirty.discard(page_id)
+        if page_id in self._pinned:
+            self._pinned[page_id] = page
+            self.buffer[page_id] = page
+            return
+        node = self._nodes.get(page_id)
+        if node is None:
+            node = _LRUNode(page_id, page)
+            self._nodes[page_id] = node
+            self._a1.push_front(node)
+        else:
+            node.value = page
+            self._touch(node)
+        self.buffer[page_id] = page
+        if len(self._nodes) > self.capacity:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop a page chosen by the 2Q policy. Dirty pages are written back first."""
+        if self._a1.length > self._a1_target or self._am.length == 0:
+            queue = self._a1
+        else:
+            queue = self._am
+        victim = queue.back()
+        queue.unlink(victim)
+        del self._nodes[victim.key]
+        del self.buffer[victim.key]
+        self._dirty.discard(victim.key)
+        if victim.value.is_dirty:
+            self.diskmanager.write_page(victim.value)
 
     def flush(self):
-        for _, page in self.buffer.items():
-            if page.is_dirty:
-                self.diskmanager.write_page(page)
+        """Write all dirty pages and mark them clean. Shadow pages stay tracked since they can be changed again."""
+        pages = [self.buffer[page_id] for page_id in sorted(self._dirty)]
+        dirty_pages = [page for page in pages if page.is_dirty]
+        if dirty_pages:
+            self.diskmanager.write_pages(dirty_pages)
+        for page in pages:
+            page.is_dirty = False
+            if not isinstance(page, ShadowPage):
+                self._dirty.discard(page.page_id)
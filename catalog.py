@@ -1,28 +1,30 @@
 import abc
 from collections import namedtuple
 from dataclasses import dataclass, field
+import heapq
+from operator import itemgetter
 import pickle
 from typing import Iterable, List, Type, Any, Tuple
 
 from config import PAGE_SIZE
+import serializer
 
-class Row(tuple):
-    pass
+# A row is a plain tuple with one value per column. Rows are accessed positionally by the
+# operators, a namedtuple or dataclass per table would only add construction and lookup cost.
+Row = tuple[Any, ...]
 
 
-import ctypes
+import struct
 
-class PageHeader(ctypes.BigEndianStructure):
-    _pack_ = 1  # Ensures no padding between fields
-    _fields_ = [
-        ("page_id", ctypes.c_int32),
-        ("data_length", ctypes.c_int32),
-        # ("row_count", ctypes.c_int16),
-    ]
+PageHeader = namedtuple('PageHeader', ['page_id', 'data_length'])
+_HEADER = struct.Struct('>ii')  # big endian page_id, data_length without padding
 
-HEADER_SIZE = ctypes.sizeof(PageHeader)
+HEADER_SIZE = _HEADER.size
+PICKLE_FRAMING_SLACK = 16  # bytes reserved for pickle framing when the size of a pickled page is estimated
 
 class BasePage:
+    __slots__ = ('page_id', 'data', 'header', 'is_dirty', 'bytes_length')
+
     def __init__(self, page_id, data: list[Row] | tuple[Row], header=None, is_dirty=True):  # data is list[Row] or Catalog
         self.page_id = page_id
         self.data = data
@@ -30,46 +32,100 @@ class BasePage:
         self.is_dirty = is_dirty
         self.bytes_length = HEADER_SIZE
     
+    def column(self, index: int) -> tuple:
+        """The values of one column, for operators that work on a column of the page at once"""
+        return tuple(map(itemgetter(index), self.data))
+
     @classmethod
-    def from_bytes(cls, page_id: int, raw_data: bytes):
-        header = PageHeader.from_buffer_copy(raw_data)
+    def from_bytes(cls, page_id: int, raw_data: bytes | memoryview):
+        """raw_data may be a view on a reused read buffer, so nothing may keep a reference to it"""
+        header = PageHeader._make(_HEADER.unpack_from(raw_data, 0))
         
         if header.data_length == 0:
             return cls(page_id, [], header=header)
             
-        pickled_data = raw_data[HEADER_SIZE : HEADER_SIZE + header.data_length]
-        rows = pickle.loads(pickled_data)
+        serialized_data = memoryview(raw_data)[HEADER_SIZE : HEADER_SIZE + header.data_length]
+        rows = serializer.loads(serialized_data)
         return cls(page_id, rows, header=header, is_dirty=False)
 
-    def to_bytes(self) -> bytes:
-        pickled_rows = pickle.dumps(self.data)
-        data_length = len(pickled_rows)
+    def to_bytes(self) -> bytearray:
+        """Returns the full PAGE_SIZE image of the page. The zero filled buffer is allocated once and
+        the header and data are written into it, the disk manager writes the bytearray as is."""
+        serialized_rows = serializer.dumps(self.data)
+        data_length = len(serialized_rows)
         
         if data_length > (PAGE_SIZE - HEADER_SIZE):
             raise MemoryError("Page overflow! Too many rows for one page.")
 
-        header = PageHeader(self.page_id, data_length)
-        
-        page_data = bytes(header) + pickled_rows
-        padding = b'\x00' * (PAGE_SIZE - len(page_data))
-        return page_data + padding
+        buffer = bytearray(PAGE_SIZE)
+        _HEADER.pack_into(buffer, 0, self.page_id, data_length)
+        buffer[HEADER_SIZE : HEADER_SIZE + data_length] = serialized_rows
+        return buffer
+
+    def to_shadow_page(self, shadow_page_id: int) -> 'ShadowPage':
+        # the copy gets a page_id that was never written, it has to be written when it is evicted
+        return ShadowPage(shadow_page_id, list(self.data), self.header, is_dirty=True)
 
 class ShadowPage(BasePage):
     """Mutable page"""
+    __slots__ = ('_is_row_format', '_data_length', '_columnar')
+
     def __init__(self, page_id, data: list[Row], header=None, is_dirty=True):  # data is list[Row] or Catalog
         self.page_id = page_id
         self.data = list(data)
         self.header: None | PageHeader = header
         self.is_dirty = is_dirty
+        # length of the serialized data, kept up to date on every change so the space check is O(row)
+        # instead of serializing the whole page for every added row
+        self._measure()
+
+    def _measure(self):
+        # while all rows share the same tags the page is serialized in the columnar layout
+        self._columnar = serializer.ColumnarLength.of(self.data)
+        if self._columnar is not None:
+            self._is_row_format = True
+            self._data_length = self._columnar.length
+            return
+        row_layout_length = serializer.row_layout_length(self.data)
+        self._is_row_format = row_layout_length is not None
+        self._data_length = row_layout_length if self._is_row_format else len(serializer.dumps(self.data))
+
+    def _row_length(self, row: Any) -> int | None:
+        """Serialized length of the row, None if the row forces the page to fall back to pickle"""
+        if not self._is_row_format:
+            return None
+        try:
+            return len(serializer.encode_row(row))
+        except serializer.RowFormatError:
+            return None
+
+    def _projected_length(self, row: Any) -> tuple[int, bool, serializer.ColumnarLength | None]:
+        """Serialized length of the data after adding row, whether the page is still in the row format
+        and the columnar length when the page is still in the columnar layout"""
+        if self._columnar is not None:
+            columnar = self._columnar.with_row(row)
+            if columnar is not None:
+                return columnar.length, True, columnar
+            # the tags diverge, from now on the page is in the row layout
+            row_layout_length = serializer.row_layout_length(self.data + [row])
+            if row_layout_length is not None:
+                return row_layout_length, True, None
+            return len(serializer.dumps(self.data + [row])), False, None
+        row_length = self._row_length(row)
+        if row_length is not None:
+            return self._data_length + row_length, True, None
+        if not self._is_row_format:
+            # Pickled pages: the pickle of the row on its own is never smaller than what it adds to the
+            # pickle of the list, apart from list framing. Only pay for pickling the whole page when the
+            # estimate gets close to full.
+            estimate = self._data_length + len(pickle.dumps(row))
+            if HEADER_SIZE + estimate + PICKLE_FRAMING_SLACK <= PAGE_SIZE:
+                return estimate, False, None
+        return len(serializer.dumps(self.data + [row])), False, None
 
     def has_space_for(self, row: Any) -> bool:
         """Check if adding this row would exceed PAGE_SIZE."""
-        # recalculating this bytes size by serializing the page and returning the result is inefficient
-        # better would be to only calculate the new data. However, I do not think bytelen(data + [row])
-        # is equal to bytelength(data) + bytelength(row). Better would be to not use native types 
-        # and let everything be a bytes. For now this is find.
-        new_data_state = self.data + [row]
-        projected_size = len(pickle.dumps(new_data_state))
+        projected_size = self._projected_length(row)[0]
         return (HEADER_SIZE + projected_size) <= PAGE_SIZE
 
     def add_row(self, row: Any) -> bool:
@@ -77,32 +133,90 @@ class ShadowPage(BasePage):
         Attempts to add a row. Returns True if successful, 
         False if the page is full.
         """
-        if self.has_space_for(row):
-            self.data.append(row)
+        projected_size, is_row_format, columnar = self._projected_length(row)
+        if HEADER_SIZE + projected_size > PAGE_SIZE:
+            return False
+        self.data.append(row)
+        self._data_length = projected_size
+        self._is_row_format = is_row_format
+        self._columnar = columnar
+        self.is_dirty = True
+        return True
+
+    def add_rows(self, rows: list[Row]) -> int:
+        """Adds rows from the front of rows for as long as they fit. Returns the number of rows added,
+        the rest goes to the next page. Rows in the columnar or row format are measured and appended in one go"""
+        added = 0
+        available = PAGE_SIZE - HEADER_SIZE
+        if self._columnar is not None:
+            columnar = self._columnar
+            for row in rows:
+                with_row = columnar.with_row(row)
+                if with_row is None:
+                    break
+                if with_row.length > available:
+                    self._columnar = columnar
+                    return self._extend(rows, added, columnar.length)
+                columnar = with_row
+                added += 1
+            self._columnar = columnar
+            self._extend(rows, added, columnar.length)
+        elif self._is_row_format:
+            data_length = self._data_length
+            for row in rows:
+                try:
+                    data_length_with_row = data_length + len(serializer.encode_row(row))
+                except serializer.RowFormatError:
+                    break
+                if data_length_with_row > available:
+                    return self._extend(rows, added, data_length)
+                data_length = data_length_with_row
+                added += 1
+            self._extend(rows, added, data_length)
+        # a row that changes the format of the page is added on its own, the rest one at a time
+        for row in rows[added:]:
+            if not self.add_row(row):
+                break
+            added += 1
+        return added
+
+    def _extend(self, rows: list[Row], count: int, data_length: int) -> int:
+        if count:
+            self.data.extend(rows[:count])
+            self._data_length = data_length
             self.is_dirty = True
-            return True
-        return False
+        return count
 
     def delete_rows(self, indices_to_remove: list[int]):
         """Use reversed order sort to remove from end to begin"""
         for index in sorted(indices_to_remove, reverse=True):
             del self.data[index]
+        self._measure()
+        self.is_dirty = True
 
 class Page(BasePage):
     """Immutable page"""
+    __slots__ = ('_columns',)
+
     def __init__(self, page_id, data: tuple[Row, ...], header=None, is_dirty=True):  # data is list[Row] or Catalog
         self.page_id = page_id
         self.data = data  # it is now a tuple such that it is immutable
         self.header: None | PageHeader = header
         self.is_dirty = is_dirty
+        self._columns: dict[int, tuple] = {}  # column index: values, filled on first use
+
+    def column(self, index: int) -> tuple:
+        """The values of one column. The page does not change, so the column is built once and kept
+        for as long as the page stays in the buffer"""
+        column = self._columns.get(index)
+        if column is None:
+            column = self._columns[index] = super().column(index)
+        return column
 
     @classmethod
     def from_shadow_page(cls, shadow_page: ShadowPage):
         return cls(shadow_page.page_id, tuple(shadow_page.data), shadow_page.header, shadow_page.is_dirty)
 
-    def to_shadow_page(self, shadow_page_id: int) -> ShadowPage:
-        return ShadowPage(shadow_page_id, list(self.data), self.header, self.is_dirty)
-
 
 @dataclass(frozen=False)
 class ShadowTable:
@@ -133,11 +247,34 @@ def from_shadow_table(shadow_table: ShadowTable):
 class Catalog:
     """Mock database schema information."""
     def __init__(self, tables: list[Table]):
-        self.tables = {table.table_name: table for table in tables}
+        self.tables = {table.table_name.lower(): table for table in tables}  # keys are always lowercase
         sorted_page_ids = sorted([id for table in tables for id in table.page_id])
-        self.free_page_ids = self._find_free_pages(sorted_page_ids)
+        # min-heap so the lowest free page_id is reused first and new pages stay close together
+        self.free_page_ids = self._find_free_pages(sorted_page_ids)  # a sorted list is a valid heap
+        self._free_set = set(self.free_page_ids)  # same ids as free_page_ids for O(1) membership checks
         self.max_page_id = sorted_page_ids[-1] if len(sorted_page_ids) else 0
         self.borrowed_page_ids = {}  # tranaction_id: page_id
+        self._init_readers()
+
+    def _init_readers(self):
+        # page_ids that are being read, e.g. by a streaming SELECT. A commit can free them while the
+        # reader is not done yet, they are only put on the free list when the last reader releases them
+        self._readers: dict[int, tuple[tuple[int, ...], int]] = {}  # id(page_ids): (page_ids, number of readers)
+        self._held_free_page_ids: set[int] = set()  # freed while being read
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_free_set', None)  # derived from free_page_ids
+        # readers do not outlive the process, on disk the held page_ids are free
+        state.pop('_readers', None)
+        state['free_page_ids'] = self.free_page_ids + sorted(state.pop('_held_free_page_ids', ()))
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        heapq.heapify(self.free_page_ids)  # catalogs written before the heap was introduced
+        self._free_set = set(self.free_page_ids)
+        self._init_readers()
 
     def _find_free_pages(self, sorted_page_ids: list[int]):
         """Two pointer algorithm to find gaps in array"""
@@ -155,19 +292,23 @@ class Catalog:
         return free_page_ids
 
     def get_table_by_name(self, name: str) -> Table:
-        table = self.tables.get(name.lower())
+        # names from the parser are lowercase already, only lower when the direct lookup misses
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables.get(name.lower())
         if table is None:
             raise Exception("Table not found")
         return table
 
     def drop_table_by_name(self, name: str):
         table = self.get_table_by_name(name)
-        self.free_page_ids += table.page_id  # take the table's pages and add them to the free list for reassignment later
-        del self.tables[table.table_name]  # remove from dict
+        self.return_page_ids(table.page_id)  # take the table's pages and add them to the free list for reassignment later
+        del self.tables[table.table_name.lower()]  # remove from dict
 
     def get_free_page_id(self, transaction_id: int) -> int:
         if self.free_page_ids:
-            page_id = self.free_page_ids.pop(0)
+            page_id = heapq.heappop(self.free_page_ids)
+            self._free_set.discard(page_id)
         else:
             page_id = self.max_page_id + 1
             self.max_page_id = page_id
@@ -176,8 +317,35 @@ class Catalog:
         self.borrowed_page_ids[transaction_id].append(page_id)
         return page_id
 
-    def return_page_ids(self, page_ids: list[int]):
-        self.free_page_ids += page_ids
+    def return_page_ids(self, page_ids: Iterable[int]):
+        held = self._held_page_ids() if self._readers else ()
+        for page_id in page_ids:
+            if page_id in held:
+                self._held_free_page_ids.add(page_id)
+            elif page_id not in self._free_set:
+                self._free_set.add(page_id)
+                heapq.heappush(self.free_page_ids, page_id)
+
+    def _held_page_ids(self) -> set[int]:
+        return {page_id for page_ids, _ in self._readers.values() for page_id in page_ids}
+
+    def hold_page_ids(self, page_ids: tuple[int, ...]):
+        """Keep the page_ids from being handed out again until release_page_ids is called with the same
+        tuple. Holding costs O(1), the page_ids are only visited when a commit frees pages meanwhile."""
+        _, count = self._readers.get(id(page_ids), (page_ids, 0))
+        self._readers[id(page_ids)] = (page_ids, count + 1)
+
+    def release_page_ids(self, page_ids: tuple[int, ...]):
+        _, count = self._readers[id(page_ids)]
+        if count > 1:
+            self._readers[id(page_ids)] = (page_ids, count - 1)
+            return
+        del self._readers[id(page_ids)]
+        if self._held_free_page_ids:
+            still_held = self._held_page_ids()
+            released = self._held_free_page_ids - still_held
+            self._held_free_page_ids -= released
+            self.return_page_ids(sorted(released))
 
     def add_new_table(self, table: Table):
         name = table.table_name.lower()
@@ -190,7 +358,7 @@ class Catalog:
 
         The page_ids have already been claimed and the transaction
         commit/rollback handles the returing page_ids"""
-        self.tables[table.table_name] = table
+        self.tables[table.table_name.lower()] = table
 
 
     def to_page(self) -> Page:
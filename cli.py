@@ -71,63 +71,49 @@ clear   - clear the terminal text
 
 def render_result(result: QueryResult, explain: bool):
     """
-    Formats and prints query results in an ASCII table.
+    Prints query results in an ASCII table. The table is written at once instead of line by line.
+    """
+    if explain:
+        render_explain(result)
+    sys.stdout.write(format_result(result))
+
+def format_result(result: QueryResult) -> str:
+    """
+    Formats query results in an ASCII table.
     """
 
     query_string = result.sql  # destructure to reuse old code
     columns = result.columns
     results = result.rows
 
-    if explain:
-        render_explain(result)
-
-    print("\n" + "="*80)
-    print(f"QUERY: {query_string}")
-    print("="*80)
+    lines = ["", "="*80, f"QUERY: {query_string}", "="*80]
     
     if result.error:
-        print("ERROR: " + str(result.error))
-        return
+        lines.append("ERROR: " + str(result.error))
+        return "\n".join(lines) + "\n"
 
     if not results:
-        print("RESULT: (Empty set)")
-        print("="*80)
-        return
+        lines.append("RESULT: (Empty set)")
+        lines.append("="*80)
+        return "\n".join(lines) + "\n"
 
     string_results = [tuple(str(x) for x in row) for row in results]
     string_columns = [str(c) for c in columns]
 
-    num_cols = len(string_columns)
-    max_widths = [len(header) for header in string_columns]
-
-    for row in string_results:
-        for i in range(num_cols):
-            max_widths[i] = max(max_widths[i], len(row[i]))
+    # widest value per column, header included
+    max_widths = [max(map(len, column)) for column in zip(string_columns, *string_results)]
 
     col_widths = [w + 2 for w in max_widths]
 
-    header_line = ""
-    for i in range(num_cols):
-        header_line += f"| {string_columns[i].center(col_widths[i] - 2)} "
-    header_line += "|"
+    header_line = "| " + " | ".join(header.center(w) for header, w in zip(string_columns, max_widths)) + " |"
     
     separator = "+" + "+".join("-" * w for w in col_widths) + "+"
 
-    print(separator)
-    print(header_line)
-    print(separator)
-
-    for row in string_results:
-        row_line = ""
-        for i in range(num_cols):
-            # Left-align the data
-            row_line += f"| {row[i].ljust(col_widths[i] - 2)} "
-        row_line += "|"
-        print(row_line)
-
-    print(separator)
-    print(f"({len(results)} rows in set)")
-    print("="*80)
+    lines += [separator, header_line, separator]
+    # Left-align the data
+    lines += ["| " + " | ".join(value.ljust(w) for value, w in zip(row, max_widths)) + " |" for row in string_results]
+    lines += [separator, f"({len(results)} rows in set)", "="*80]
+    return "\n".join(lines) + "\n"
 
 def render_explain(result):
     if result.tokens:
@@ -1,3 +1,12 @@
 
 # PAGE_SIZE = 4096  # Standard 4KB page
 PAGE_SIZE = 16384
+WRITE_BATCH_SIZE = 32  # max number of pages written with one vectored write
+MAX_READAHEAD_PAGES = 32  # upper limit of the readahead window for sequential reads
+PARSE_CACHE_SIZE = 256  # number of parsed sql statements kept by the engine
+TRANSACTION_POOL_SIZE = 64  # number of terminated transaction objects the engine keeps for reuse
+AGGREGATE_BATCH_SIZE = 1024  # rows that are grouped together before the aggregate states are updated
+JOIN_BLOCK_SIZE = 64  # left rows that are joined with all right rows in one go by the nested loop join
+JOIN_MEMORY_ROWS = 100_000  # right rows the nested loop join keeps in memory, the rest is spilled to a temporary file
+JOIN_SPILL_CHUNK_SIZE = 4096  # right rows per pickled chunk of the spill file
+INSERT_BATCH_SIZE = 1024  # prepared rows that are added to the pages of a table in one go
@@ -1,28 +1,90 @@
+import mmap
 import os
-from config import PAGE_SIZE
+from typing import Iterable
+from config import PAGE_SIZE, WRITE_BATCH_SIZE
 from catalog import Catalog, Page
 
+HAS_FADVISE = hasattr(os, 'posix_fadvise')  # not available on every platform, prefetching is only a hint anyway
+
 class DiskManager:
     def __init__(self, db_path: str):
         self.db_path = db_path
-        # Create file if it doesn't exist
-        if not os.path.exists(db_path):
+        # the file stays open for the lifetime of the manager; all I/O goes through positional pread/pwrite
+        self._fd = os.open(db_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # Write the catalog page if the file is new
+        if os.fstat(self._fd).st_size == 0:
             catalog = Catalog.get_empty_catalog()
             page = catalog.to_page()
-            with open(db_path, 'wb') as f:
-                f.write(page.to_bytes())
+            os.pwrite(self._fd, page.to_bytes(), 0)
+        # pages are decoded straight from a read only mapping of the file, no copy into a read buffer.
+        # Writes still go through pwrite, the mapping is renewed when the file has grown past it
+        self._mm = None
+        self._map_file()
+
+    def _map_file(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._mm = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        if getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
 
     def read_page(self, page_id: int) -> Page:
         offset = page_id * PAGE_SIZE
-        with open(self.db_path, 'rb') as f:
-            f.seek(offset)
-            return Page.from_bytes(page_id, f.read(PAGE_SIZE))
+        if offset + PAGE_SIZE > len(self._mm):
+            if offset + PAGE_SIZE > os.fstat(self._fd).st_size:
+                raise ValueError(f"Page {page_id} does not exist on disk")
+            self._map_file()
+        with memoryview(self._mm) as view:
+            return Page.from_bytes(page_id, view[offset:offset + PAGE_SIZE])
+
+    def prefetch(self, page_ids: Iterable[int]):
+        """Tell the kernel these pages will be read soon so it can load them in the background.
+        One hint is issued per run of consecutive page_ids."""
+        if not HAS_FADVISE:
+            return
+        page_ids = sorted(page_ids)
+        if not page_ids:
+            return
+        start = prev = page_ids[0]
+        for page_id in page_ids[1:]:
+            if page_id != prev + 1:
+                os.posix_fadvise(self._fd, start * PAGE_SIZE, (prev - start + 1) * PAGE_SIZE, os.POSIX_FADV_WILLNEED)
+                start = page_id
+            prev = page_id
+        os.posix_fadvise(self._fd, start * PAGE_SIZE, (prev - start + 1) * PAGE_SIZE, os.POSIX_FADV_WILLNEED)
 
     def write_page(self, page: Page):
         data = page.to_bytes()
         if len(data) != PAGE_SIZE:
             raise ValueError("Data must be exactly PAGE_SIZE")
-        offset = page.page_id * PAGE_SIZE
-        with open(self.db_path, 'r+b') as f:
-            f.seek(offset)
-            f.write(data)
+        os.pwrite(self._fd, data, page.page_id * PAGE_SIZE)
+
+    def write_pages(self, pages: Iterable[Page]):
+        """Write many pages at once. Pages are sorted on page_id and every run of
+        consecutive page_ids is written with a single pwritev call."""
+        pages = sorted(pages, key=lambda p: p.page_id)
+        if not pages:
+            return
+        run: list[Page] = []
+        for page in pages:
+            if run and (page.page_id != run[-1].page_id + 1 or len(run) == WRITE_BATCH_SIZE):
+                self._write_run(run)
+                run = []
+            run.append(page)
+        self._write_run(run)
+
+    def _write_run(self, run: list[Page]):
+        buffers = [page.to_bytes() for page in run]
+        for data in buffers:
+            if len(data) != PAGE_SIZE:
+                raise ValueError("Data must be exactly PAGE_SIZE")
+        os.pwritev(self._fd, buffers, run[0].page_id * PAGE_SIZE)
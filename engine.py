@@ -1,22 +1,90 @@
+from collections import deque
+from copy import copy
+from functools import lru_cache
+from operator import is_not
 from operators import Operator
 import traceback
-from typing import List
+from typing import Any, List
 
+from config import PARSE_CACHE_SIZE, TRANSACTION_POOL_SIZE
 from enums import TransactionStatus
 from errors import DBError, ParserError, SQLSyntaxError, TableNotFoundError
 from request import QueryRequest
 from result import QueryResult
 from queryplanner import QueryPlanner
 from schema import Schema
-from sql_interpreter import tokenize, TokenStream, Parser
-from syntax_tree import TransactionModifier, BeginStatement, CommitStatement, RollbackStatement
-from transaction import Transaction
+from sql_interpreter import tokenize, parameterize, TokenStream, Parser
+from syntax_tree import ASTNode, Literal, SelectStatement, TransactionModifier, BeginStatement, CommitStatement, RollbackStatement
+from transaction import ReadOnlyTransaction, Transaction
+
+def _bind(node: Any, values: dict[int, Any]) -> Any:
+    """A copy of the tree with the literal nodes whose id is in values replaced by literals with
+    that value. Only the nodes above a replaced literal are copied, the rest is shared. The tree
+    itself is left as is, so the cached parse of the shape is never changed."""
+    if isinstance(node, Literal):
+        if id(node) in values:
+            return Literal(values[id(node)], node.alias)
+        return node
+    if isinstance(node, list):
+        items = [_bind(item, values) for item in node]
+        return items if any(map(is_not, items, node)) else node
+    if isinstance(node, ASTNode):
+        changes = {name: bound for name, value in vars(node).items() if (bound := _bind(value, values)) is not value}
+        if not changes:
+            return node
+        node = copy(node)
+        vars(node).update(changes)
+    return node
+
+# statement type: how it ends the running transaction
+TRANSACTION_ENDS = {
+    CommitStatement: Transaction.commit,
+    RollbackStatement: Transaction.rollback,
+}
+
 
 class DatabaseEngine:
     def __init__(self, catalog, buffermanager):
         self.catalog = catalog
         self.buffer_manager = buffermanager
-        self.transactions = {}  # id: transaction
+        self.transactions = {}  # id: transaction, only the transactions started with BEGIN
+        self._next_transaction_id = 1  # ids only need to be unique, they are never reused
+        self._transaction_pool: deque[Transaction] = deque()  # terminated transactions ready for reuse
+        self._read_only_transaction = ReadOnlyTransaction(buffermanager, catalog)  # used by auto commit SELECTs
+        # one stream and parser are reset for every statement instead of constructing new ones
+        self._token_stream = TokenStream([])
+        self._parser = Parser(self._token_stream)
+        # parses of statement shapes and their bound copies, kept per engine as they use its parser
+        self._parse_shape = lru_cache(maxsize=PARSE_CACHE_SIZE)(self._parse)
+        self._parse_bound = lru_cache(maxsize=PARSE_CACHE_SIZE)(self._bind_shape)
+
+    def _parse(self, tokens) -> tuple[ASTNode, list[Literal]]:
+        self._token_stream.reset(tokens)
+        self._parser.reset(self._token_stream)
+        return self._parser.parse(), self._parser.literals
+
+    def _bind_shape(self, shape: tuple[str, ...], params: tuple) -> ASTNode | None:
+        """The parse of the shape with the literal values of the statement, None when they can not be bound"""
+        ast_root, literals = self._parse_shape(shape)
+        if len(literals) != len(params):  # a literal token that is not parsed as a literal, do not share
+            return None
+        return _bind(ast_root, dict(zip(map(id, literals), params)))
+
+    def compile_sql(self, sql: str) -> tuple[list[str], ASTNode]:
+        """Tokenize and parse the sql. Statements that only differ in their literals share the parse of
+        their shape, the literal values of this statement are bound into a copy of it. The same
+        statement gets the same AST, which is never changed afterwards. The plan is not cached since
+        it is bound to the transaction."""
+        tokens = tokenize(sql)
+        shape, params = parameterize(tokens)
+        try:
+            ast_root = self._parse_bound(shape, tuple(params))
+        except ParserError:
+            # parse what the user typed, so the error points at their tokens and not at a placeholder
+            ast_root = None
+        if ast_root is None:
+            ast_root = self._parse(tokens)[0]
+        return tokens, ast_root
 
     def get_transaction_by_id(self, id: int):
         t = self.transactions.get(id)
@@ -24,16 +92,52 @@ class DatabaseEngine:
             raise Exception(f"No transaction with id {id}")
         return t
 
-    def get_annonimous_transaction(self):
-        transaction = Transaction(-1, self.buffer_manager, self.catalog)
-        self.transactions[-1] = transaction
+    def _acquire_transaction(self, id: int) -> Transaction:
+        if self._transaction_pool:
+            transaction = self._transaction_pool.pop()
+            transaction.reset(id)
+        else:
+            transaction = Transaction(id, self.buffer_manager, self.catalog)
+        if id != -1:  # the anonymous transaction only lives during execute, it is not registered
+            self.transactions[id] = transaction
         return transaction
 
+    def _end_transaction(self, transaction: Transaction | ReadOnlyTransaction):
+        """Forget the committed or rolled back transaction and keep the object for reuse"""
+        if isinstance(transaction, ReadOnlyTransaction):
+            return
+        if transaction.id != -1:
+            del self.transactions[transaction.id]
+        if len(self._transaction_pool) < TRANSACTION_POOL_SIZE:
+            self._transaction_pool.append(transaction)
+
+    def get_annonimous_transaction(self):
+        return self._acquire_transaction(-1)
+
     def get_new_transaction(self):
-        new_id = max(self.transactions.keys()) + 1 if self.transactions.keys() else 1
-        transaction = Transaction(new_id, self.buffer_manager, self.catalog)
-        self.transactions[new_id] = transaction
-        return transaction
+        new_id = self._next_transaction_id
+        self._next_transaction_id += 1
+        return self._acquire_transaction(new_id)
+
+    def _stream_rows(self, query_plan_root: Operator, transaction: Transaction, commit: bool):
+        """Yield the rows of the plan without materializing them. The anonymous transaction is
+        committed when the rows are exhausted, or rolled back if producing them fails or the
+        stream is closed before that."""
+        try:
+            # execute starts the generator up to here, so closing an unread stream also ends the transaction
+            yield
+            yield from query_plan_root.rows()
+        except GeneratorExit:
+            if commit:
+                transaction.rollback()
+                self._end_transaction(transaction)
+            raise
+        except Exception:
+            transaction.rollback()
+            raise
+        if commit:
+            transaction.commit()
+            self._end_transaction(transaction)
 
     def execute(self, request: QueryRequest) -> QueryResult:
         sql = request.sql
@@ -43,51 +147,62 @@ class DatabaseEngine:
         transaction = None
         transaction_status = TransactionStatus.OPEN
         try:
-            if sql[-1] != ';':
-                sql += ';'
-            tokens = tokenize(sql)
-            stream = TokenStream(tokens)
-            parser = Parser(stream) 
-            ast_root = parser.parse()
+            tokens, ast_root = self.compile_sql(sql)
+            statement_type = type(ast_root)
             # if isinstance(ast_root, BeginStatement) and request.auto_commit:
             #     raise Exception("Cannot use auto commit with transaction modifiers.")
-            if isinstance(ast_root, BeginStatement) and request.transaction_id != -1:
-                raise ParserError("First commit or rollback current transaction.")
-            if isinstance(ast_root, (CommitStatement, RollbackStatement)) and request.transaction_id == -1:
-                raise ParserError("Cannot end transaction before starting one.")
-
-            if isinstance(ast_root, BeginStatement):
+            if statement_type is BeginStatement:
+                if request.transaction_id != -1:
+                    raise ParserError("First commit or rollback current transaction.")
                 transaction = self.get_new_transaction()
                 return QueryResult(columns=['status'], rows=[('Success',)], sql=sql, tokens=tokens, ast=ast_root, query_plan=query_plan_root, rowcount=1, transaction_status=transaction_status, transaction_id=transaction.id)
+            end_transaction = TRANSACTION_ENDS.get(statement_type)
+            if end_transaction is not None and request.transaction_id == -1:
+                raise ParserError("Cannot end transaction before starting one.")
 
             if request.transaction_id != -1:
                 transaction = self.get_transaction_by_id(request.transaction_id)
+            elif request.auto_commit and statement_type is SelectStatement:
+                # a stream is read after execute returned, other statements run in between
+                transaction = ReadOnlyTransaction(self.buffer_manager, self.catalog) if request.streaming else self._read_only_transaction
+                transaction.begin()
             elif request.auto_commit:
                 transaction = self.get_annonimous_transaction()
             else:
                 transaction = self.get_new_transaction()
 
-            if isinstance(ast_root, CommitStatement):
-                transaction.commit()
-                del self.transactions[transaction.id]
-                return QueryResult(columns=['status'], rows=[('Success',)], sql=sql, tokens=tokens, ast=ast_root, query_plan=query_plan_root, rowcount=1, transaction_status=TransactionStatus.CLOSED, transaction_id=transaction.id)
-            if isinstance(ast_root, RollbackStatement):
-                transaction.rollback()
-                del self.transactions[transaction.id]
+            if end_transaction is not None:
+                end_transaction(transaction)
+                self._end_transaction(transaction)
                 return QueryResult(columns=['status'], rows=[('Success',)], sql=sql, tokens=tokens, ast=ast_root, query_plan=query_plan_root, rowcount=1, transaction_status=TransactionStatus.CLOSED, transaction_id=transaction.id)  # put tranaction id back to -1
 
             planner = QueryPlanner(transaction)
             query_plan_root: Operator = planner.plan_query(ast_root)
 
-            rows = [row for row, _ ,_ in query_plan_root.next()]
-
             schema: Schema = query_plan_root.get_output_schema()
             column_names: List[str] = schema.get_names()
 
+            if request.streaming and statement_type is SelectStatement:
+                is_annonimous = request.auto_commit and transaction.id == -1
+                rows = self._stream_rows(query_plan_root, transaction, is_annonimous)
+                next(rows)
+                return QueryResult(
+                    columns=column_names,
+                    rows=rows,
+                    sql=sql,
+                    tokens=tokens,
+                    ast=ast_root,
+                    query_plan=query_plan_root,
+                    transaction_status=TransactionStatus.CLOSED if is_annonimous else transaction_status,
+                    transaction_id=transaction.id
+                )
+
+            rows = list(query_plan_root.rows())
+
             if request.auto_commit and transaction.id == -1:
                 # if this is an annonimous transaction commit it
                 transaction.commit()
-                del self.transactions[transaction.id]
+                self._end_transaction(transaction)
                 transaction_status = TransactionStatus.CLOSED
 
             return QueryResult(
@@ -114,6 +229,26 @@ class DatabaseEngine:
         #         transaction_status=transaction_status
         #     )
 
+        except ParserError as e:
+            # syntax and validation errors: the message says it all, no traceback is formatted. A
+            # validation error of the planner comes after the transaction was acquired and may follow
+            # a partly planned write. A transaction that only existed for this statement is rolled back,
+            # which returns any page it obtained. An explicit transaction stays open, like on rollback=False
+            if transaction is not None and request.auto_commit and request.transaction_id == -1:
+                transaction.rollback()
+                self._end_transaction(transaction)
+                transaction_status = TransactionStatus.CLOSED
+            return QueryResult(
+                columns=['status'],
+                rows=[('Error',)],
+                sql=sql,
+                tokens=tokens,
+                ast=ast_root,
+                query_plan=query_plan_root,
+                error=f"{type(e).__name__}: {e}",
+                transaction_id=transaction.id if transaction else request.transaction_id,
+                transaction_status=transaction_status
+            )
         except Exception as e:
             if transaction and getattr(e, 'rollback', True):
                 transaction.rollback()
@@ -37,7 +37,7 @@ table2 = Table('contract', ['id', 'employee_id', 'start_date', 'end_date'], [int
 diskmanager = DiskManager('.db')
 buffermanager = BufferManager(diskmanager, 10)
 
-catalog_page = buffermanager.get_page(0)
+catalog_page = buffermanager.pin(0)
 catalog = Catalog.from_page(catalog_page)
 
 BOOTSTRAP = False  # fills the database with dummy data
@@ -51,6 +51,7 @@ if BOOTSTRAP:
 
 engine = DatabaseEngine(catalog, buffermanager)
 repl(engine)
-diskmanager.write_page(catalog.to_page())
+# the catalog page goes through the buffer so it is written in the same batch as the data pages
+buffermanager.put(catalog.to_page())
 buffermanager.flush()
 
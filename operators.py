@@ -1,14 +1,20 @@
 import abc
-from typing import Callable, Generator, List, Any, Literal, Optional
-from functools import cmp_to_key
+import heapq
+import pickle
+import tempfile
+from typing import IO, Callable, Generator, Iterable, Iterator, List, Any, Literal, Optional
+from itertools import chain, compress, groupby, islice, repeat
+from functools import lru_cache, partial
+from operator import attrgetter, is_not, itemgetter
 from dataclasses import dataclass
-from catalog import ShadowPage, ShadowTable, Table, Catalog, Page
+from config import (AGGREGATE_BATCH_SIZE, INSERT_BATCH_SIZE, JOIN_BLOCK_SIZE, JOIN_MEMORY_ROWS, JOIN_SPILL_CHUNK_SIZE,
+                    PARSE_CACHE_SIZE)
+from catalog import ShadowPage, ShadowTable, Table, Catalog, Page, Row
 from syntax_tree import Literal
 
 from schema import ColumnIdentifier, Schema
 from tests.test_transaction import transaction
 from transaction import Transaction
-Row = tuple[Any, ...]
 
 @dataclass
 class AggregateSpec:
@@ -16,6 +22,8 @@ class AggregateSpec:
     extractor: Callable[[Row], Any] # Changed from arg_index to extractor
     is_distinct: bool
     output_name: str
+    column: Optional[int] = None  # input column when the argument is a plain column
+    is_star: bool = False  # COUNT(*)
 
 class Operator(abc.ABC):
     """Abstract Base Class for all relational operators."""
@@ -24,6 +32,12 @@ class Operator(abc.ABC):
     def next(self) -> Generator[Row, None, None]:
         raise NotImplementedError
 
+    def rows(self) -> Iterator[Row]:
+        """The rows of next() without their location. Operators that only transform or cut the row
+        stream override this with C level iterators (map, islice) over the rows of their parent,
+        so a Filter -> Projection -> Limit chain costs no generator round trip per operator."""
+        return map(itemgetter(0), self.next())
+
     @abc.abstractmethod
     def display_plan(self, level: int = 0) -> str:
         raise NotImplementedError
@@ -55,6 +69,13 @@ class ScanOperator(Operator):
             for idx, row in enumerate(page.data):
                 yield row, page.page_id, idx 
 
+    def batches(self) -> Iterator[Page | ShadowPage]:
+        """Page at a time access to the scanned rows"""
+        return iter(self.gen)
+
+    def rows(self) -> Iterator[Row]:
+        return chain.from_iterable(map(attrgetter('data'), self.gen))
+
     # def next(self):
     #     for page_id in self.transaction.get_table_by_name(self.table_name).page_id:
     #         page = self.transaction.buffer_manager.get_page(page_id)
@@ -69,6 +90,10 @@ class ScanOperator(Operator):
         indent = '  ' * level
         return f"{indent}* TableScan (Source: {self.table_name})"
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile_row_preparer(source: str):
+    return compile(f'lambda raw: ({source},)', '<row preparer>', 'eval')
+
 class Insert(Operator):
     def __init__(self, table: ShadowTable, data_generator: Generator, column_indices: list[int], transaction):
         self.shadow_table = table
@@ -76,36 +101,39 @@ class Insert(Operator):
         self.transaction.prepare_shadow_table_for_write(self.shadow_table)
         self.data_generator = data_generator
         self.column_indices = column_indices
+        self._prepare_row = self._build_row_preparer()
 
     def next(self):
-        for raw_val_tuple in self.data_generator():
-            new_row = self._prepare_row(raw_val_tuple)
+        new_rows = map(self._prepare_row, self.data_generator())
+        # rows are added a batch at a time, so the last page is looked up once per batch instead of per row
+        while batch := list(islice(new_rows, INSERT_BATCH_SIZE)):
             page: Page | ShadowPage = self.transaction.buffer_manager.get_page(self.shadow_table.page_id[-1])
             if isinstance(page, Page):
                 raise Exception("Page object not writable")
-            page_is_full = not page.add_row(new_row)
-            if page_is_full:
+            added = page.add_rows(batch)
+            while added < len(batch):
                 page = self.transaction.get_new_page(self.shadow_table)
-                page_is_full = not page.add_row(new_row)
-                if page_is_full:
+                added_to_page = page.add_rows(batch[added:])
+                if not added_to_page:
                     raise Exception("Page size is to small for even 1 row!")
+                added += added_to_page
         yield(tuple(['SUCCESS']), None, None)
 
 
-    def _prepare_row(self, raw_val_tuple) -> Row:
-        new_row = []
-        for src_idx in self.column_indices:
-            if src_idx is not None:
-                typ = self.shadow_table.column_datatypes[len(new_row)]
-                val = raw_val_tuple[src_idx]
-                if isinstance(val, Literal):
-                    val = val.value
-                new_row.append(typ(val))
-            else:
-                new_row.append(None) # Default/Null
-        return tuple(new_row)
+    def _build_row_preparer(self) -> Callable[[Row], Row]:
+        """A function that builds the table row from the values of one insert row, generated for the
+        columns of the table so there is no loop or lookup of the column types per value. Values that
+        are not given are None"""
+        constants = {'Literal': Literal}
+        fields = []
+        for position, src_idx in enumerate(self.column_indices):
+            if src_idx is None:
+                fields.append('None')
+                continue
+            constants[f't{position}'] = self.shadow_table.column_datatypes[position]
+            fields.append(f't{position}(v.value if isinstance(v := raw[{src_idx}], Literal) else v)')
+        return eval(_compile_row_preparer(', '.join(fields)), constants)
 
-        
     def display_plan(self, level=0) -> str:
         indent = '  ' * level
         return f"{indent}* Insert into: {self.shadow_table.table_name})"
@@ -120,22 +148,26 @@ class Delete(Operator):
         self.transaction = transaction
         self.drop_dict = {}
 
+    def _delete_from_page(self, pid: int, drop_list: list[int]):
+        # copy and change the page in one go. The scan reads the next pages in between which can
+        # evict the shadow page, changes made to it after that would be lost
+        shadow_page = self.transaction.copy_on_write(self.shadow_table, pid)
+        shadow_page.delete_rows(drop_list)
+
     def next(self):
         row_count = 0
         current_pid = None
         drop_list = []
-        shadow_page: None | ShadowPage = None
         for _, pid, idx in self.parent.next():
             if pid != current_pid:
-                if shadow_page and drop_list:
-                    shadow_page.delete_rows(drop_list)
-                shadow_page = self.transaction.copy_on_write(self.shadow_table, pid)
+                if drop_list:
+                    self._delete_from_page(current_pid, drop_list)
                 drop_list = []
                 current_pid = pid
             drop_list.append(idx)
             row_count += 1
-        if shadow_page:
-            shadow_page.delete_rows(drop_list)
+        if drop_list:
+            self._delete_from_page(current_pid, drop_list)
 
         yield tuple([f'Deleted {row_count} rows']), None, None
 
@@ -150,15 +182,56 @@ class Delete(Operator):
             
 
 class Filter(Operator):
-    def __init__(self, predicate: Callable, parent: Operator):
+    def __init__(self, predicate: Callable, parent: Operator, column_comparison: Optional[tuple[int, Callable, Any]] = None,
+                 page_selector: Optional[Callable[[list[Row]], Iterable[int]]] = None):
         self.predicate = predicate
         self.parent = parent
+        # (column index, comparison function, value) when the predicate is comparison(row[index], value).
+        # A page is then filtered without calling python code per row
+        self.column_comparison = column_comparison
+        # returns the indices of the matching rows of a page, with the predicate inlined so it is not called per row
+        self.page_selector = page_selector
+
+    def _matching_indices(self, rows: list[Row], page: Page | ShadowPage) -> Iterable[int]:
+        if self.column_comparison is not None:
+            index, compare, value = self.column_comparison
+            return compress(range(len(rows)), map(compare, page.column(index), repeat(value)))
+        if self.page_selector is not None:
+            return self.page_selector(rows)
+        return compress(range(len(rows)), map(self.predicate, rows))
 
     def next(self):
+        if isinstance(self.parent, ScanOperator):
+            # evaluate the predicate over a whole page at once
+            for page in self.parent.batches():
+                rows = page.data
+                pid = page.page_id
+                for idx in self._matching_indices(rows, page):
+                    yield rows[idx], pid, idx
+            return
+        predicate = self.predicate
         for row, pid, idx in self.parent.next():
-            if self.predicate(row):
+            if predicate(row):
                 yield row, pid, idx
 
+    def rows(self) -> Iterator[Row]:
+        if isinstance(self.parent, ScanOperator):
+            return chain.from_iterable(map(self._matching_rows, self.parent.batches()))
+        return filter(self.predicate, self.parent.rows())
+
+    def count_matching(self, page: Page | ShadowPage) -> int:
+        """Number of matching rows of the page, without building the rows or their indices if possible"""
+        if self.column_comparison is not None:
+            index, compare, value = self.column_comparison
+            return sum(map(compare, page.column(index), repeat(value)))
+        if self.page_selector is not None:
+            return len(self.page_selector(page.data))
+        return sum(1 for _ in self._matching_indices(page.data, page))
+
+    def _matching_rows(self, page: Page | ShadowPage) -> Iterator[Row]:
+        rows = page.data
+        return map(rows.__getitem__, self._matching_indices(rows, page))
+
     def get_output_schema(self) -> Schema:
         return self.parent.get_output_schema()
 
@@ -169,14 +242,43 @@ class Filter(Operator):
         return '\n'.join(output)
 
 class Projection(Operator):
-    def __init__(self, extractors: List[Callable[[Row], Any]], output_schema: Schema, parent: Operator):
+    def __init__(self, extractors: List[Callable[[Row], Any]], output_schema: Schema, parent: Operator,
+                 column_indices: Optional[List[int]] = None, project: Optional[Callable[[Row], Row]] = None):
         self.output_schema = output_schema
         self.parent = parent
         self.extractors = extractors
+        self.column_indices = column_indices  # set when every output column is an input column
+        self.project = project  # all extractors compiled into one function that returns the output row
+        self._project = self._build_projection()
+
+    def _build_projection(self) -> Optional[Callable[[Row], Row]]:
+        """The function that projects a row, None when the rows pass unchanged. Plain columns are
+        taken with a single itemgetter call instead of calling an extractor per column"""
+        indices = self.column_indices
+        if indices is None:
+            if self.project is not None:
+                return self.project
+            extractors = self.extractors
+            return lambda row: tuple([extractor(row) for extractor in extractors])
+        if indices == list(range(len(self.parent.get_output_schema().columns))):
+            return None
+        if len(indices) == 1:  # itemgetter with one index returns the value, not a tuple
+            getter = itemgetter(indices[0])
+            return lambda row: (getter(row),)
+        return itemgetter(*indices)
 
     def next(self):
+        project = self._project
+        if project is None:
+            yield from self.parent.next()
+            return
         for row, pid, idx in self.parent.next():
-            yield tuple(extractor(row) for extractor in self.extractors), pid, idx
+            yield project(row), pid, idx
+
+    def rows(self) -> Iterator[Row]:
+        if self._project is None:
+            return self.parent.rows()
+        return map(self._project, self.parent.rows())
     
     def get_output_schema(self) -> Schema:
         return self.output_schema
@@ -189,29 +291,55 @@ class Projection(Operator):
         return '\n'.join(output)
 
 class Sorter(Operator):
-    def __init__(self, sort_keys: List[tuple[Callable, bool]], parent: Operator):
+    def __init__(self, sort_keys: List[tuple[Callable, bool]], parent: Operator, limit: Optional[int] = None,
+                 pass_keys: Optional[List[Callable[[Row], Any]]] = None):
         self.sort_keys = sort_keys  # (extractor_func, is_descending)
         self.parent = parent
+        self.limit = limit  # only the first limit rows are needed, set when a LIMIT follows the ORDER BY
+        # consecutive keys with the same direction are sorted in one pass on a tuple of their values.
+        # pass_keys has the key function of every pass when the planner compiled them
+        self._passes: list[tuple[Callable[[Row], Any], bool]] = []
+        for pass_index, (is_descending, group) in enumerate(groupby(sort_keys, key=itemgetter(1))):
+            extractors = [extractor for extractor, _ in group]
+            if pass_keys is not None:
+                row_key = pass_keys[pass_index]
+            elif len(extractors) == 1:
+                row_key = extractors[0]
+            else:
+                row_key = lambda row, extractors=extractors: tuple([extractor(row) for extractor in extractors])
+            self._passes.append((row_key, is_descending))
         
     def next(self):
+        if self.limit is not None and len(self._passes) == 1:
+            # top k with a heap: O(n log k) and only k rows are kept. Same result as sorted()[:k]
+            row_key, is_descending = self._passes[0]
+            select = heapq.nlargest if is_descending else heapq.nsmallest
+            yield from select(self.limit, self.parent.next(), key=lambda item: row_key(item[0]))
+            return
         all_rows = list(self.parent.next())
         if not all_rows: return
-
-        def compare_rows(row_a, row_b):
-            for extractor, is_descending in self.sort_keys:
-                val_a = extractor(row_a)
-                val_b = extractor(row_b)
-                
-                # Handle None/Nulls if necessary (Python comparison might fail on None)
-                if val_a == val_b:
-                    continue
-                
-                # Basic Comparison
-                if val_a < val_b: return -1 if not is_descending else 1
-                if val_a > val_b: return 1 if not is_descending else -1
-            return 0
-
-        yield from sorted(all_rows, key=cmp_to_key(compare_rows))
+        # sort is stable, so sorting from the least to the most significant key gives the full order
+        order = range(len(all_rows))
+        rows = list(map(itemgetter(0), all_rows))
+        for row_key, is_descending in reversed(self._passes):
+            keys = list(map(row_key, rows))
+            order = sorted(order, key=keys.__getitem__, reverse=is_descending)
+        if self.limit is not None:
+            order = order[:self.limit]
+        yield from map(all_rows.__getitem__, order)
+
+    def rows(self) -> Iterator[Row]:
+        """Sorts the bare rows in place: no (row, page_id, idx) triples and no list of positions"""
+        if self.limit is not None and len(self._passes) == 1:
+            row_key, is_descending = self._passes[0]
+            select = heapq.nlargest if is_descending else heapq.nsmallest
+            return iter(select(self.limit, self.parent.rows(), key=row_key))
+        rows = list(self.parent.rows())
+        for row_key, is_descending in reversed(self._passes):
+            rows.sort(key=row_key, reverse=is_descending)
+        if self.limit is not None:
+            del rows[self.limit:]
+        return iter(rows)
 
     def get_output_schema(self) -> Schema:
         return self.parent.get_output_schema()
@@ -223,19 +351,49 @@ class Sorter(Operator):
         return '\n'.join(output)
 
 class Distinct(Operator):
-    def __init__(self, extractors: List[Callable[[Row], Any]], parent: Operator):
+    def __init__(self, extractors: List[Callable[[Row], Any]], parent: Operator,
+                 column_indices: Optional[List[int]] = None):
         self.extractors = extractors
         self.parent = parent
-        self.unique_keys = set() 
+        self.column_indices = column_indices  # set when every key column is an input column
+        self.unique_keys = set()
+        self._key = self._build_key()
+
+    def _build_key(self) -> Optional[Callable[[Row], Any]]:
+        """The function that gives the key of a row, None when the whole row is the key. Plain columns
+        are taken with a single itemgetter call, with one index that is the value itself"""
+        indices = self.column_indices
+        if indices is None:
+            extractors = self.extractors
+            return lambda row: tuple([extractor(row) for extractor in extractors])
+        if indices == list(range(len(self.parent.get_output_schema().columns))):
+            return None
+        return itemgetter(*indices)
 
     def next(self) -> Generator[Row, None, None]:
-        self.unique_keys = set()
-        for row, pid, idx in self.parent.next():
-            key = tuple(ext(row) for ext in self.extractors)
-            if key not in self.unique_keys:
-                self.unique_keys.add(key)
-                yield row, pid, idx
-            
+        self.unique_keys = unique_keys = set()
+        key = self._key
+        for item in self.parent.next():
+            row_key = item[0] if key is None else key(item[0])
+            if row_key not in unique_keys:
+                unique_keys.add(row_key)
+                yield item
+
+    def rows(self) -> Iterator[Row]:
+        self.unique_keys = unique_keys = set()
+        key = self._key
+        if key is None:  # rows are tuples, hashed as they are
+            for row in self.parent.rows():
+                if row not in unique_keys:
+                    unique_keys.add(row)
+                    yield row
+            return
+        for row in self.parent.rows():
+            row_key = key(row)
+            if row_key not in unique_keys:
+                unique_keys.add(row_key)
+                yield row
+
     def get_output_schema(self) -> Schema:
         return self.parent.get_output_schema()
 
@@ -251,13 +409,10 @@ class Limit(Operator):
         self.parent = parent
         
     def next(self):
-        yielded = 0
-        for row, pid, idx in self.parent.next():
-            if yielded < self.count:
-                yield row, pid, idx
-                yielded += 1
-            else:
-                break
+        return islice(self.parent.next(), self.count)
+
+    def rows(self) -> Iterator[Row]:
+        return islice(self.parent.rows(), self.count)
                 
     def get_output_schema(self) -> Schema:
         return self.parent.get_output_schema()
@@ -269,32 +424,62 @@ class Limit(Operator):
         return '\n'.join(output)
 
 class AggregationState:
+    """State of one aggregate in one group. update_many takes the values of a batch of rows at once
+    so the aggregation itself runs in C builtins. There is an instance per group per aggregate, so
+    the states use slots instead of an instance dict."""
+    __slots__ = ('result',)
+
     def __init__(self): self.result = self._get_initial_value()
     def _get_initial_value(self): raise NotImplementedError
     def update(self, value): raise NotImplementedError
+    def update_many(self, values: list):
+        for value in values:
+            self.update(value)
     def finalize(self): return self.result
 
+_is_not_none = partial(is_not, None)
+
+def _non_null(values: list) -> list:
+    """values without the NULLs. Mostly there are none, then the reductions get the values as is
+    instead of through a filter call per value"""
+    if None in values:
+        return list(filter(_is_not_none, values))
+    return values
+
 class SumState(AggregationState):
+    __slots__ = ()
     def _get_initial_value(self): return 0
     def update(self, value): 
         if value is not None: self.result += value
+    def update_many(self, values):
+        self.result += sum(_non_null(values))
 
 class CountState(AggregationState):
+    __slots__ = ()
     def _get_initial_value(self): return 0
     def update(self, value): 
         if value is not None: self.result += 1
+    def update_many(self, values):
+        self.result += len(values) - values.count(None)
 
 class MaxState(AggregationState):
+    __slots__ = ()
     def _get_initial_value(self): return None
     def update(self, value):
         if value is not None and (self.result is None or value > self.result): self.result = value
+    def update_many(self, values):
+        self.update(max(_non_null(values), default=None))
 
 class MinState(AggregationState):
+    __slots__ = ()
     def _get_initial_value(self): return None
     def update(self, value):
         if value is not None and (self.result is None or value < self.result): self.result = value
+    def update_many(self, values):
+        self.update(min(_non_null(values), default=None))
                 
 class AvgState(AggregationState):
+    __slots__ = ('sum_state', 'count_state')
     def __init__(self):
         self.sum_state = SumState()
         self.count_state = CountState()
@@ -302,6 +487,10 @@ class AvgState(AggregationState):
     def update(self, value):
         self.sum_state.update(value)
         self.count_state.update(value)
+    def update_many(self, values):
+        values = _non_null(values)
+        self.sum_state.result += sum(values)
+        self.count_state.result += len(values)
     def finalize(self):
         total_sum = self.sum_state.result
         total_n = self.count_state.result
@@ -309,9 +498,13 @@ class AvgState(AggregationState):
         return total_sum / total_n
 
 class CountDistinctState(AggregationState):
+    __slots__ = ()
     def _get_initial_value(self): return set()
     def update(self, value): 
         if value is not None: self.result.add(value)
+    def update_many(self, values):
+        self.result.update(values)
+        self.result.discard(None)
     def finalize(self): return len(self.result)
 
 AGGREGATE_MAP = {
@@ -320,31 +513,96 @@ AGGREGATE_MAP = {
 }
 
 class Aggregate(Operator):
-    def __init__(self, group_extractors: List[Callable], specs: List[AggregateSpec], output_schema: Schema, parent: Operator):
+    def __init__(self, group_extractors: List[Callable], specs: List[AggregateSpec], output_schema: Schema, parent: Operator,
+                 group_key: Optional[Callable[[Row], tuple]] = None):
         self.group_extractors = group_extractors
         self.specs = specs
         self.output_schema = output_schema
         self.parent = parent
+        self._state_factories = [AGGREGATE_MAP[spec.function + (' DISTINCT' if spec.is_distinct else '')] for spec in specs]
+        self._value_extractors = [spec.extractor for spec in specs]
+        # a single group column is grouped on its value instead of a 1-tuple per row, with an
+        # itemgetter from the planner computing all keys of a batch does not leave C
+        if len(group_extractors) == 1:
+            self._group_key = group_extractors[0]
+        elif group_key is not None:  # a single function for all group columns from the planner
+            self._group_key = group_key
+        else:
+            self._group_key = lambda row: tuple([extractor(row) for extractor in group_extractors])
+
+    def _aggregate_columns(self) -> Optional[list[AggregationState]]:
+        """Aggregate without groups over a scan, a page at a time: the argument of every aggregate
+        is a whole column of the page, taken from the page's column cache when it is a plain column.
+        None if the table is empty."""
+        states = None
+        for page in self.parent.batches():
+            rows = page.data
+            if not rows:
+                continue
+            if states is None:
+                states = [factory() for factory in self._state_factories]
+            for state, spec in zip(states, self.specs):
+                if spec.column is not None:
+                    state.update_many(page.column(spec.column))
+                else:
+                    state.update_many(list(map(spec.extractor, rows)))
+        return states
+
+    def _count_rows(self) -> Optional[int]:
+        """Number of input rows, counted a page at a time when the input is a (filtered) scan"""
+        parent = self.parent
+        if isinstance(parent, ScanOperator):
+            return sum(map(len, map(attrgetter('data'), parent.batches())))
+        if isinstance(parent, Filter) and isinstance(parent.parent, ScanOperator):
+            return sum(map(parent.count_matching, parent.parent.batches()))
+        return None
 
     def next(self):
+        if not self.group_extractors and all(spec.is_star and spec.function == 'COUNT' and not spec.is_distinct
+                                             for spec in self.specs):
+            # only COUNT(*): the rows are counted, never produced
+            count = self._count_rows()
+            if count is not None:
+                if count:
+                    yield tuple([count] * len(self.specs)), None, None
+                return
+        if not self.group_extractors and isinstance(self.parent, ScanOperator):
+            states = self._aggregate_columns()
+            if states is not None:
+                yield tuple([s.finalize() for s in states]), None, None
+            return
         grouped_states = {}
-        for row, _, _ in self.parent.next():
-            # Calculate group key using extractors
-            group_key = tuple(extractor(row) for extractor in self.group_extractors)
-            
-            if group_key not in grouped_states:
-                states = []
-                for spec in self.specs:
-                    key = spec.function + (' DISTINCT' if spec.is_distinct else '')
-                    states.append(AGGREGATE_MAP[key]())
-                grouped_states[group_key] = states
-
-            for i, spec in enumerate(self.specs):
-                # Calculate value to aggregate using extractor
-                val = spec.extractor(row)
-                grouped_states[group_key][i].update(val)
+        group_extractors = self.group_extractors
+        state_factories = self._state_factories
+        value_extractors = self._value_extractors
+        rows = self.parent.rows()
+        # rows are aggregated in batches: grouped first, then every state is updated once per group
+        # with all values of the batch
+        while batch := list(islice(rows, AGGREGATE_BATCH_SIZE)):
+            if group_extractors:
+                groups = {}
+                for group_key, row in zip(map(self._group_key, batch), batch):
+                    group = groups.get(group_key)
+                    if group is None:
+                        groups[group_key] = [row]
+                    else:
+                        group.append(row)
+            else:
+                groups = {(): batch}
+
+            for group_key, group_rows in groups.items():
+                states = grouped_states.get(group_key)
+                if states is None:
+                    states = grouped_states[group_key] = [factory() for factory in state_factories]
 
+                for state, extractor in zip(states, value_extractors):
+                    # Calculate values to aggregate using extractor
+                    state.update_many(list(map(extractor, group_rows)))
+
+        single_key = len(group_extractors) == 1
         for group_key, states in grouped_states.items():
+            if single_key:
+                group_key = (group_key,)
             yield tuple(list(group_key) + [s.finalize() for s in states]), None, None
 
     def get_output_schema(self) -> Schema:
@@ -356,22 +614,109 @@ class Aggregate(Operator):
         output.append(self.parent.display_plan(level + 1))
         return '\n'.join(output)
 
+class HashJoin(Operator):
+    """Join on equal key columns. The right rows are put in a hash table on their key once, every
+    left row then only meets the right rows with the same key instead of all of them. The output
+    is in the same order as NestedLoopJoin: per left row the matching right rows in input order"""
+    def __init__(self, left: Operator, right: Operator, left_keys: List[int], right_keys: List[int],
+                 residual: Optional[Callable[[Row], Any]] = None):
+        self.left = left
+        self.right = right
+        self.left_keys = left_keys  # key column indices in the left rows
+        self.right_keys = right_keys  # matching key column indices in the right rows
+        self.residual = residual  # the rest of the join condition, on the combined row
+        # with one key column the key is the value itself, otherwise a tuple. Both sides agree
+        self._left_key = itemgetter(*left_keys)
+        self._right_key = itemgetter(*right_keys)
+
+    def _build(self) -> dict[Any, list[Row]]:
+        table = {}
+        rows = list(self.right.rows())
+        for key, row in zip(map(self._right_key, rows), rows):
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [row]
+            else:
+                bucket.append(row)
+        return table
+
+    def rows(self) -> Iterator[Row]:
+        get = self._build().get
+        left_key = self._left_key
+        residual = self.residual
+        no_match = ()
+        for left_row in self.left.rows():
+            for right_row in get(left_key(left_row), no_match):
+                row = left_row + right_row
+                if residual is None or residual(row):
+                    yield row
+
+    def next(self):
+        return zip(self.rows(), repeat(None), repeat(None))
+
+    def get_output_schema(self) -> Schema:
+        return self.left.get_output_schema() + self.right.get_output_schema()
+
+    def display_plan(self, level=0):
+        indent = '  ' * level
+        return f"{indent}* Hash Join\n{self.left.display_plan(level+1)}\n{self.right.display_plan(level+1)}"
+
+def _spilled_chunks(spill: IO[bytes]) -> Iterator[list[Row]]:
+    spill.seek(0)
+    while True:
+        try:
+            yield pickle.load(spill)
+        except EOFError:
+            return
+
 class NestedLoopJoin(Operator):
-    def __init__(self, left: Operator, right: Operator, predicate: Callable):
+    def __init__(self, left: Operator, right: Operator, predicate: Callable,
+                 block_joiner: Optional[Callable[[list[Row], list[Row]], list[Row]]] = None):
         self.left = left
         self.right = right
         self.predicate = predicate
-        self._right_rows = None
+        # returns the joined rows of a block of left rows and the right rows, with the condition inlined
+        # on the pair of rows so only matching pairs are concatenated
+        self.block_joiner = block_joiner
+
+    def rows(self) -> Iterator[Row]:
+        """The left rows are joined a block at a time: the pairs of a block of left rows with all right
+        rows are tested in one comprehension instead of resuming a generator for every pair. When the
+        right side is spilled, a block is joined with the rows in memory first and then with every
+        spilled chunk, so the rows of a block are no longer in left row order"""
+        right_rows, spill = self._materialize_right()
+        join = self.block_joiner
+        if join is None:
+            predicate = self.predicate
+            join = lambda block, right_rows: [row for left_row in block for right_row in right_rows
+                                              if predicate(row := left_row + right_row)]
+        left_rows = self.left.rows()
+        try:
+            while block := list(islice(left_rows, JOIN_BLOCK_SIZE)):
+                yield from join(block, right_rows)
+                if spill is not None:
+                    for chunk in _spilled_chunks(spill):
+                        yield from join(block, chunk)
+        finally:
+            if spill is not None:
+                spill.close()
+
+    def _materialize_right(self) -> tuple[list[Row], Optional[IO[bytes]]]:
+        """The right rows are read for every block of left rows. Up to JOIN_MEMORY_ROWS of them are kept
+        in memory, the rest is pickled to a temporary file in chunks of JOIN_SPILL_CHUNK_SIZE rows"""
+        right_rows = self.right.rows()
+        in_memory = list(islice(right_rows, JOIN_MEMORY_ROWS))
+        if len(in_memory) < JOIN_MEMORY_ROWS:
+            return in_memory, None
+        spill = None
+        while chunk := list(islice(right_rows, JOIN_SPILL_CHUNK_SIZE)):
+            if spill is None:
+                spill = tempfile.TemporaryFile()
+            pickle.dump(chunk, spill, pickle.HIGHEST_PROTOCOL)
+        return in_memory, spill
 
     def next(self):
-        if self._right_rows is None:
-            self._right_rows = list(self.right.next())
-
-        for left_row, _, _ in self.left.next():
-            for right_row, _, _ in self._right_rows:
-                combined_row = left_row + right_row
-                if self.predicate(combined_row):
-                    yield combined_row, None, None
+        return zip(self.rows(), repeat(None), repeat(None))
 
     def get_output_schema(self) -> Schema:
         return self.left.get_output_schema() + self.right.get_output_schema()
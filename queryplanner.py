@@ -1,31 +1,95 @@
 from ast import Delete
 from dataclasses import dataclass
+from functools import lru_cache, partial, reduce
+import operator
+from itertools import groupby
 from enum import StrEnum, auto
 from typing import List, Callable
-import operator
 from buffermanager import BufferManager
 from syntax_tree import (
     ASTNode, BinaryOp, DeleteStatement, DropStatement, InsertStatement, SelectStatement,
     TableRef, AggregateCall, Join, Expression, Star, ColumnRef, Literal,
     CreateStatement, BeginStatement, CommitStatement, RollbackStatement) 
 from operators import ( Filter, ScanOperator, Projection, Sorter, Limit, Aggregate,
-    Distinct, NestedLoopJoin, AggregateSpec, Operator, StatusOperator, Insert, Delete
+    Distinct, HashJoin, NestedLoopJoin, AggregateSpec, Operator, StatusOperator, Insert, Delete
 )
 from catalog import Catalog, ShadowTable, Table, Page
 from schema import ColumnIdentifier, Schema
 from datetime import date, datetime
+from config import PARSE_CACHE_SIZE
 
 from tests.test_transaction import transaction
 from transaction import Transaction
 
-OPERATOR_MAP = {
-    '+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv,
-    '=': operator.eq, '!=': operator.ne, '>': operator.gt, '<': operator.lt,
-    '>=': operator.ge, '<=': operator.le, '%': operator.mod,
-    'AND': lambda x, y: bool(x) and bool(y),
-    'OR':  lambda x, y: bool(x) or bool(y),
+# python source of the operators, used when an expression is compiled into a single function
+OPERATOR_SOURCE = {
+    '+': '{} + {}', '-': '{} - {}', '*': '{} * {}', '/': '{} / {}', '%': '{} % {}',
+    '=': '{} == {}', '!=': '{} != {}', '>': '{} > {}', '<': '{} < {}', '>=': '{} >= {}', '<=': '{} <= {}',
+}
+ARITHMETIC_OPERATORS = {'+', '-', '*', '/', '%'}
+LOGICAL_OPERATORS = {'AND': ' and ', 'OR': ' or '}
+# operators whose result is already a bool, the operands of AND/OR are only wrapped in bool() otherwise
+BOOLEAN_OPERATORS = {'=', '!=', '>', '<', '>=', '<='} | set(LOGICAL_OPERATORS)
+# order in which the operands of AND/OR are evaluated, lowest first: AND starts with the comparison
+# most likely to be false, OR with the one most likely to be true, so they short circuit early
+OPERAND_RANKS = {
+    'AND': {'=': 0, '<': 1, '>': 1, '<=': 1, '>=': 1, '!=': 2},
+    'OR': {'!=': 0, '<': 1, '>': 1, '<=': 1, '>=': 1, '=': 2},
+}
+
+def _node_count(expr: Expression) -> int:
+    if isinstance(expr, BinaryOp):
+        return 1 + _node_count(expr.left) + _node_count(expr.right)
+    return 1
+
+def _has_arithmetic(expr: Expression) -> bool:
+    """Arithmetic can raise (division by zero), operands with it keep the order of the query"""
+    if isinstance(expr, BinaryOp):
+        return expr.op in ARITHMETIC_OPERATORS or _has_arithmetic(expr.left) or _has_arithmetic(expr.right)
+    return False
+
+def _logical_operands(expr: Expression, op: str) -> list[Expression]:
+    """The operands of a chain of the same logical operator, a AND b AND c gives [a, b, c]"""
+    if isinstance(expr, BinaryOp) and expr.op == op:
+        return _logical_operands(expr.left, op) + _logical_operands(expr.right, op)
+    return [expr]
+
+def _operand_order(operand: Expression, op: str) -> tuple[int, bool, int]:
+    """Sort key of an operand of op. A comparison with a literal goes before a comparison of the same
+    kind between two columns, which is usually less selective and loads two values"""
+    if not isinstance(operand, BinaryOp):
+        return 3, True, 1
+    rank = OPERAND_RANKS[op].get(operand.op, 3)
+    has_literal = isinstance(operand.left, Literal) or isinstance(operand.right, Literal)
+    return rank, not has_literal, _node_count(operand)
+
+# comparison: (function, function with the operands swapped)
+COMPARISON_FUNCTIONS = {
+    '=': (operator.eq, operator.eq), '!=': (operator.ne, operator.ne),
+    '>': (operator.gt, operator.lt), '<': (operator.lt, operator.gt),
+    '>=': (operator.ge, operator.le), '<=': (operator.le, operator.ge),
 }
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile_source(source: str):
+    return compile(f'lambda row: {source}', '<expression>', 'eval')
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile_page_selector(source: str):
+    """A function that returns the indices of the rows of a page for which the expression is true"""
+    return compile(f'lambda rows: [idx for idx, row in enumerate(rows) if {source}]', '<page selector>', 'eval')
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile_block_joiner(source: str):
+    """A function that joins a block of left rows with the right rows, the join condition is inlined
+    and reads the columns from the pair of rows"""
+    return compile(f'lambda block, right_rows: [left + right for left in block for right in right_rows if {source}]',
+                   '<block joiner>', 'eval')
+
+def _pair_column_source(left_width: int, idx: int) -> str:
+    """Source reading column idx of the combined row from the left or the right row"""
+    return f'left[{idx}]' if idx < left_width else f'right[{idx - left_width}]'
+
 TYPE_MAP = {
     'TEXT': str,
     'INT': int,
@@ -59,9 +123,7 @@ class QueryPlanner:
 
         # 2. WHERE
         if stmt.where_clause:
-            input_schema = plan.get_output_schema()
-            predicate_fn = self._compile_expression(stmt.where_clause, input_schema)
-            plan = Filter(predicate_fn, plan)
+            plan = self._plan_filter(stmt.where_clause, plan)
 
         table = self.transaction.get_table_by_name(stmt.from_clause.name)
         shadow_table = self.transaction.get_or_create_shadow_table(table)
@@ -120,9 +182,7 @@ class QueryPlanner:
 
         # 2. WHERE
         if stmt.where_clause:
-            input_schema = plan.get_output_schema()
-            predicate_fn = self._compile_expression(stmt.where_clause, input_schema)
-            plan = Filter(predicate_fn, plan)
+            plan = self._plan_filter(stmt.where_clause, plan)
 
         # 3. GROUP BY & AGGREGATE
         if stmt.group_by_clause or self._has_aggregates(stmt.columns):
@@ -132,8 +192,9 @@ class QueryPlanner:
         if stmt.is_distinct and not stmt.group_by_clause:
             plan = self._plan_projection(stmt.columns, plan)
             projected_schema = plan.get_output_schema()
-            extractors = [lambda row, i=idx: row[i] for idx in range(len(projected_schema.columns))]
-            plan = Distinct(extractors, plan)
+            column_indices = list(range(len(projected_schema.columns)))
+            extractors = [operator.itemgetter(idx) for idx in column_indices]
+            plan = Distinct(extractors, plan, column_indices)
 
         # 5. ORDER BY
         if stmt.order_by_clause:
@@ -141,6 +202,8 @@ class QueryPlanner:
 
         # 6. LIMIT
         if stmt.limit_clause:
+            if isinstance(plan, Sorter):
+                plan.limit = stmt.limit_clause.count  # the sorter only has to find the first rows
             plan = Limit(stmt.limit_clause.count, plan)
 
         # 7. FINAL PROJECTION
@@ -149,32 +212,94 @@ class QueryPlanner:
 
         return plan
 
+    def _plan_filter(self, condition: Expression, plan: Operator) -> Filter:
+        input_schema = plan.get_output_schema()
+        constants = {}
+        source = self._expression_source(condition, input_schema, constants)
+        predicate_fn = eval(_compile_source(source), constants)
+        page_selector = eval(_compile_page_selector(source), constants)
+        return Filter(predicate_fn, plan, self._column_comparison(condition, input_schema), page_selector)
+
+    def _column_comparison(self, expr: Expression, schema: Schema) -> tuple[int, Callable, object] | None:
+        """(column index, comparison function, value) if expr compares a column with a literal"""
+        if not isinstance(expr, BinaryOp) or expr.op not in COMPARISON_FUNCTIONS:
+            return None
+        compare, swapped = COMPARISON_FUNCTIONS[expr.op]
+        if isinstance(expr.left, ColumnRef) and isinstance(expr.right, Literal):
+            return schema.resolve(expr.left.qualifier, expr.left.name), compare, expr.right.value
+        if isinstance(expr.left, Literal) and isinstance(expr.right, ColumnRef):
+            return schema.resolve(expr.right.qualifier, expr.right.name), swapped, expr.left.value
+        return None
+
     def _compile_expression(self, expr: Expression, schema: Schema) -> Callable:
         """
-        Recursively compiles an AST expression into a callable function.
+        Compiles an AST expression into a single function of the row. The expression tree is
+        turned into python source once, so evaluating it per row is one call instead of a call per node.
+        Literals are passed in as names, so expressions that only differ in their literals share the code.
         """
+        constants = {}
+        source = self._expression_source(expr, schema, constants)
+        return eval(_compile_source(source), constants)
+
+    def _expression_source(self, expr: Expression, schema: Schema, constants: dict,
+                           column_source: Callable[[int], str] = 'row[{}]'.format) -> str:
+        """column_source gives the source that reads a column of the (combined) row by its index"""
         if isinstance(expr, Literal):
-            return lambda row, v=expr.value: v
+            name = f'c{len(constants)}'
+            constants[name] = expr.value
+            return name
 
         if isinstance(expr, ColumnRef):
             idx = schema.resolve(expr.qualifier, expr.name)
-            return lambda row, i=idx: row[i]
+            return column_source(idx)
 
         if isinstance(expr, AggregateCall):
             # Used when referencing an aggregate result in ORDER BY or HAVING
             # The schema passed here must be the output of the Aggregate operator
             idx = schema.resolve(None, expr.get_lookup_name())
-            return lambda row, i=idx: row[i]
+            return column_source(idx)
+
+        if isinstance(expr, BinaryOp) and expr.op in LOGICAL_OPERATORS:
+            operands = _logical_operands(expr, expr.op)
+            if not any(map(_has_arithmetic, operands)):
+                operands.sort(key=lambda operand: _operand_order(operand, expr.op))  # stable for ties
+            sources = [self._as_boolean(operand, self._expression_source(operand, schema, constants, column_source))
+                       for operand in operands]
+            return '(' + LOGICAL_OPERATORS[expr.op].join(sources) + ')'
 
         if isinstance(expr, BinaryOp):
-            left_fn = self._compile_expression(expr.left, schema)
-            right_fn = self._compile_expression(expr.right, schema)
-            op_fn = OPERATOR_MAP[expr.op]
-            return lambda row: op_fn(left_fn(row), right_fn(row))
+            left = self._expression_source(expr.left, schema, constants, column_source)
+            right = self._expression_source(expr.right, schema, constants, column_source)
+            return '(' + OPERATOR_SOURCE[expr.op].format(left, right) + ')'
 
         raise ValueError(f"Planner Error: Do not know how to compile AST node {type(expr)}")
 
-    def _plan_from(self, node) -> ScanOperator | NestedLoopJoin:
+    def _column_extractor(self, expr: Expression, schema: Schema) -> Callable:
+        """Like _compile_expression, but a plain column becomes an itemgetter so operators that
+        extract it for every row (sort keys, group keys, aggregate arguments) stay in C"""
+        if isinstance(expr, ColumnRef):
+            return operator.itemgetter(schema.resolve(expr.qualifier, expr.name))
+        return self._compile_expression(expr, schema)
+
+    def _key_function(self, exprs: List[Expression], schema: Schema) -> Callable:
+        """One function for the key of several expressions, as used for group keys and sort keys: a
+        single expression is its own key, plain columns are taken with one itemgetter call and other
+        expressions are compiled together into one function that returns the tuple"""
+        if len(exprs) == 1:
+            return self._column_extractor(exprs[0], schema)
+        if all(isinstance(expr, ColumnRef) for expr in exprs):
+            return operator.itemgetter(*[schema.resolve(expr.qualifier, expr.name) for expr in exprs])
+        constants = {}
+        sources = [self._expression_source(expr, schema, constants) for expr in exprs]
+        return eval(_compile_source(f'({", ".join(sources)},)'), constants)
+
+    @staticmethod
+    def _as_boolean(expr: Expression, source: str) -> str:
+        if isinstance(expr, BinaryOp) and expr.op in BOOLEAN_OPERATORS:
+            return source
+        return f'bool({source})'
+
+    def _plan_from(self, node) -> ScanOperator | HashJoin | NestedLoopJoin:
         if isinstance(node, TableRef):
             table_name = node.name
             alias = node.alias or node.name
@@ -195,12 +320,42 @@ class QueryPlanner:
             right = self._plan_from(node.right)
             
             combined_schema = left.get_output_schema() + right.get_output_schema()
+            left_width = len(left.get_output_schema().columns)
+            left_keys, right_keys, residual = self._equi_join_keys(node.condition, combined_schema, left_width)
+            if left_keys:
+                residual_predicate = None
+                if residual:
+                    residual_predicate = self._compile_expression(reduce(partial(BinaryOp, 'AND'), residual), combined_schema)
+                return HashJoin(left, right, left_keys, right_keys, residual_predicate)
+
             predicate = self._compile_expression(node.condition, combined_schema)
-            
-            return NestedLoopJoin(left, right, predicate)
+            # the same condition on a pair of rows, so the combined row is only built for the matches
+            constants = {}
+            column_source = partial(_pair_column_source, left_width)
+            source = self._expression_source(node.condition, combined_schema, constants, column_source)
+            block_joiner = eval(_compile_block_joiner(source), constants)
+            return NestedLoopJoin(left, right, predicate, block_joiner)
 
         raise TypeError(f"Unknown FROM node: {type(node)}")
 
+    def _equi_join_keys(self, condition: Expression, schema: Schema, left_width: int) -> tuple[list[int], list[int], list[Expression]]:
+        """Split a join condition in the column pairs it requires to be equal (left column index, right
+        column index relative to the right rows) and the conjuncts that remain"""
+        left_keys, right_keys, residual = [], [], []
+        for conjunct in _logical_operands(condition, 'AND'):
+            if (isinstance(conjunct, BinaryOp) and conjunct.op == '='
+                    and isinstance(conjunct.left, ColumnRef) and isinstance(conjunct.right, ColumnRef)):
+                a = schema.resolve(conjunct.left.qualifier, conjunct.left.name)
+                b = schema.resolve(conjunct.right.qualifier, conjunct.right.name)
+                if a > b:
+                    a, b = b, a
+                if a < left_width <= b:
+                    left_keys.append(a)
+                    right_keys.append(b - left_width)
+                    continue
+            residual.append(conjunct)
+        return left_keys, right_keys, residual
+
     def _plan_aggregate(self, stmt: SelectStatement, plan) -> Aggregate:
         input_schema = plan.get_output_schema()
         
@@ -210,7 +365,7 @@ class QueryPlanner:
         if stmt.group_by_clause:
             for col in stmt.group_by_clause.columns:
                 # Compile the group expression
-                extractor = self._compile_expression(col, input_schema)
+                extractor = self._column_extractor(col, input_schema)
                 group_extractors.append(extractor)
                 
                 # Determine name for the schema
@@ -231,38 +386,61 @@ class QueryPlanner:
         unique_aggs = {agg.get_lookup_name(): agg for agg in all_aggs}
 
         for lookup_name, agg_node in unique_aggs.items():
-            if isinstance(agg_node.argument, Star):
+            column = None
+            is_star = isinstance(agg_node.argument, Star)
+            if is_star:
                 arg_extractor = lambda row: 1
             else:
-                arg_extractor = self._compile_expression(agg_node.argument, input_schema)
+                arg_extractor = self._column_extractor(agg_node.argument, input_schema)
+                if isinstance(agg_node.argument, ColumnRef):
+                    column = input_schema.resolve(agg_node.argument.qualifier, agg_node.argument.name)
 
             specs.append(AggregateSpec(
                 function=agg_node.function_name,
                 extractor=arg_extractor,
                 is_distinct=agg_node.is_distinct,
-                output_name=lookup_name
+                output_name=lookup_name,
+                column=column,
+                is_star=is_star
             ))
             
             agg_cols.append(ColumnIdentifier(name=lookup_name, alias=agg_node.alias, is_aggregate=True))
 
         output_schema = Schema(group_cols + agg_cols)
-        return Aggregate(group_extractors, specs, output_schema, plan)
+        group_key = None
+        if len(group_extractors) > 1:
+            group_key = self._key_function(stmt.group_by_clause.columns, input_schema)
+        return Aggregate(group_extractors, specs, output_schema, plan, group_key)
 
     def _plan_projection(self, columns: List[Expression], plan: Operator) -> Projection:
         input_schema: Schema = plan.get_output_schema()
         
         extractors = []
         schema_columns_columns = []
+        column_indices = []  # input index per output column, only kept while every output is a plain column
+        constants = {}
+        sources = []  # source of every output column, compiled into one function that builds the output row
         for expr in columns:
             if isinstance(expr, Star):
                 for i, col_info in enumerate(input_schema.columns):
                     extractors.append(lambda row, idx=i: row[idx])
                     schema_columns_columns.append(col_info)
+                    sources.append(f'row[{i}]')
+                    if column_indices is not None:
+                        column_indices.append(i)
             else:
                 extractors.append(self._compile_expression(expr, input_schema))
                 schema_columns_columns.append(ColumnIdentifier(name=expr.get_lookup_name(), alias=expr.alias))
+                sources.append(self._expression_source(expr, input_schema, constants))
+                if column_indices is not None and isinstance(expr, ColumnRef):
+                    column_indices.append(input_schema.resolve(expr.qualifier, expr.name))
+                else:
+                    column_indices = None
 
-        return Projection(extractors, Schema(schema_columns_columns), plan)
+        project = None
+        if column_indices is None:
+            project = eval(_compile_source(f'({", ".join(sources)},)'), constants)
+        return Projection(extractors, Schema(schema_columns_columns), plan, column_indices, project)
 
     def _plan_order_by(self, order_by_clause, plan) -> Sorter:
         schema: Schema = plan.get_output_schema()
@@ -271,10 +449,13 @@ class QueryPlanner:
         for item in order_by_clause.sort_items:
             # Compile the order expression (e.g., price * quantity)
             # This allows sorting by values not explicitly in the SELECT list
-            extractor = self._compile_expression(item.column, schema)
+            extractor = self._column_extractor(item.column, schema)
             sort_keys.append((extractor, item.direction == "DESC"))
-            
-        return Sorter(sort_keys, plan)
+
+        # the Sorter sorts once per run of keys with the same direction, every run gets one key function
+        pass_keys = [self._key_function([item.column for item in items], schema)
+                     for _, items in groupby(order_by_clause.sort_items, key=lambda item: item.direction == "DESC")]
+        return Sorter(sort_keys, plan, pass_keys=pass_keys)
 
     def _has_aggregates(self, columns: List[Expression]) -> bool:
         for col in columns:
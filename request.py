@@ -8,3 +8,9 @@ class QueryRequest:
     transaction_id: int = -1
     auto_commit: bool = True
     params: Optional[Dict[str, Any]] = None
+    streaming: bool = False  # SELECT rows are returned as an iterator that is consumed once
+
+    def __post_init__(self):
+        # normalize once so the engine can use the text as is, e.g. as key of the parse cache
+        if not self.sql.endswith(';'):
+            object.__setattr__(self, 'sql', self.sql + ';')
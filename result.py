@@ -4,12 +4,12 @@ from operators import Operator
 
 
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Iterator, List, Optional
 
 @dataclass
 class QueryResult:
     columns: List[str]
-    rows: List[tuple]
+    rows: List[tuple] | Iterator[tuple]
     sql: str
     tokens: List[str]
     ast: ASTNode
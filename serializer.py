@@ -0,0 +1,365 @@
+"""Binary layout of the rows in a page.
+
+A page payload starts with one magic byte. It is either a pickle (the pickle PROTO opcode 0x80),
+the columnar layout or the row layout. The magic byte of the latter two also tells if the rows
+were held in a list or a tuple. Pickle is the fallback for anything that is not a sequence of rows
+of plain values, like the catalog on page 0.
+
+Row layout, a sequence of encoded rows:
+    >H              number of values n
+    n tag bytes     the type of every value, see FIELD_TYPES
+    fixed part      struct packed values. Variable length values only store their byte length here,
+                    as >H since no value longer than a page is stored in a page
+    variable part   the raw bytes of the variable length values in column order
+
+Columnar layout, used when all rows have the same tags (no NULLs mixed with values):
+    >I              number of rows r
+    >H              number of columns n
+    n tag bytes     the type of every column
+    per column      r struct packed values. Variable length columns store r lengths followed by
+                    the concatenated raw bytes
+Int columns and the lengths of variable length columns start with one byte, the struct format
+they are packed with. It is the narrowest that fits the smallest and largest value of the column
+(b/h/i/q for ints, B/H/I for lengths), most columns then take one or two bytes per value.
+Decoding a column is a single struct call and the rows are rebuilt with zip, both in C.
+
+Decoded strings are interned. Columns like a city repeat a few values over many rows, every row
+then shares one object and comparing it with an interned literal is an identity check.
+"""
+import pickle
+import struct
+import sys
+from array import array
+from datetime import date, datetime
+from itertools import accumulate, repeat
+from typing import Any
+
+LIST_MAGIC = b'L'
+TUPLE_MAGIC = b'T'
+COLUMNAR_LIST_MAGIC = b'C'
+COLUMNAR_TUPLE_MAGIC = b'K'
+PICKLE_MAGIC = 0x80
+
+_COUNT = struct.Struct('>H')
+_ROW_COUNT = struct.Struct('>I')
+
+# python type: (tag, struct format of the fixed part, is variable length, decoder)
+FIELD_TYPES = {
+    type(None): (ord('N'), '', False, None),
+    bool: (ord('B'), '?', False, bool),
+    int: (ord('i'), 'q', False, int),
+    float: (ord('f'), 'd', False, float),
+    str: (ord('s'), 'H', True, lambda raw: sys.intern(str(raw, 'utf-8'))),
+    bytes: (ord('b'), 'H', True, bytes),
+    date: (ord('d'), 'i', False, date.fromordinal),
+    datetime: (ord('t'), 'H', True, lambda raw: datetime.fromisoformat(str(raw, 'utf-8'))),
+}
+_TAG_BY_TYPE = {typ: bytes([spec[0]]) for typ, spec in FIELD_TYPES.items()}
+_SPEC_BY_TAG = {spec[0]: spec for spec in FIELD_TYPES.values()}
+_NONE_TAG, _INT_TAG, _STR_TAG, _DATE_TAG, _DATETIME_TAG = ord('N'), ord('i'), ord('s'), ord('d'), ord('t')
+# (struct format, exclusive bound) from narrow to wide, for the values of int columns and the lengths
+# of variable length columns in the columnar layout
+_INT_FORMATS = [(fmt, 1 << (8 * struct.calcsize(f'>{fmt}') - 1)) for fmt in 'bhiq']
+_LENGTH_FORMATS = [(fmt, 1 << (8 * struct.calcsize(f'>{fmt}'))) for fmt in 'BHI']
+_WIDTH = {fmt: struct.calcsize(f'>{fmt}') for fmt in {spec[1] for spec in FIELD_TYPES.values()} | set('bhiqBHI')}
+# per type what ColumnarLength keeps track of: the int itself, the byte length of variable length values
+_MEASURE_BY_TYPE = {typ: lambda value: 0 for typ in FIELD_TYPES}
+_MEASURE_BY_TYPE.update({
+    int: int,
+    str: lambda value: len(value) if value.isascii() else len(value.encode('utf-8')),
+    bytes: len,
+    datetime: lambda value: len(value.isoformat()),
+})
+# struct formats of the columns that are decoded into an array: a memory copy and at most a
+# byteswap instead of unpacking every value into a tuple
+_ARRAY_FORMATS = {fmt for fmt in 'bhiqd' if array(fmt).itemsize == struct.calcsize(f'>{fmt}')}
+
+
+class RowFormatError(Exception):
+    """The value can not be expressed in the row format. The caller falls back to pickle."""
+
+
+class _RowCodec:
+    """Packs and unpacks the rows that share one sequence of tags"""
+    def __init__(self, tags: bytes):
+        specs = [_SPEC_BY_TAG[tag] for tag in tags]
+        self.fixed = struct.Struct('>' + ''.join(spec[1] for spec in specs))
+        self.prefix = _COUNT.pack(len(tags)) + tags
+        self.fields = [(spec[2], spec[3]) for spec in specs]  # (is_variable, decoder)
+
+    def pack(self, row: tuple) -> bytes:
+        fixed_values = []
+        var_parts = []
+        for value in row:
+            typ = type(value)
+            if typ is str:
+                raw = value.encode('utf-8')
+            elif typ is bytes:
+                raw = value
+            elif typ is datetime:
+                raw = value.isoformat().encode('utf-8')
+            elif typ is date:
+                fixed_values.append(value.toordinal())
+                continue
+            elif value is None:
+                continue
+            else:
+                fixed_values.append(value)
+                continue
+            fixed_values.append(len(raw))
+            var_parts.append(raw)
+        try:
+            fixed_part = self.fixed.pack(*fixed_values)
+        except struct.error as e:  # e.g. an int that does not fit in 64 bits
+            raise RowFormatError(str(e))
+        return self.prefix + fixed_part + b''.join(var_parts)
+
+    def unpack_from(self, buffer: memoryview, offset: int) -> tuple[tuple, int]:
+        """Unpack the row whose fixed part starts at offset. Returns the row and the offset after it."""
+        fixed_values = iter(self.fixed.unpack_from(buffer, offset))
+        offset += self.fixed.size
+        row = []
+        for is_variable, decode in self.fields:
+            if decode is None:
+                row.append(None)
+            elif is_variable:
+                length = next(fixed_values)
+                row.append(decode(buffer[offset:offset + length]))
+                offset += length
+            else:
+                row.append(decode(next(fixed_values)))
+        return tuple(row), offset
+
+
+_codecs: dict[bytes, _RowCodec] = {}
+
+def _get_codec(tags: bytes) -> _RowCodec:
+    codec = _codecs.get(tags)
+    if codec is None:
+        codec = _codecs[tags] = _RowCodec(tags)
+    return codec
+
+def encode_row(row: Any) -> bytes:
+    """Encode a single row. Raises RowFormatError if the row can not be expressed in the row format."""
+    if type(row) is not tuple:
+        raise RowFormatError(f"Row must be a tuple, got {type(row)}")
+    try:
+        tags = b''.join([_TAG_BY_TYPE[type(value)] for value in row])
+    except KeyError as e:
+        raise RowFormatError(f"No row format for type {e}")
+    return _get_codec(tags).pack(row)
+
+def row_layout_length(rows: list | tuple) -> int | None:
+    """Length of the rows in the row layout, None if they can not be expressed in it. This is
+    the length of dumps(rows) when the rows do not share the same tags."""
+    try:
+        return len(LIST_MAGIC) + sum([len(encode_row(row)) for row in rows])
+    except RowFormatError:
+        return None
+
+def _int_format(low: int, high: int) -> str:
+    for fmt, bound in _INT_FORMATS:
+        if -bound <= low and high < bound:
+            return fmt
+    raise struct.error(f"int {low if low < -bound else high} does not fit in 64 bits")
+
+def _length_format(longest: int) -> str:
+    for fmt, bound in _LENGTH_FORMATS:
+        if longest < bound:
+            return fmt
+    raise struct.error(f"value of {longest} bytes is too long")
+
+def _lengths_to_bytes(lengths: list[int]) -> bytes:
+    fmt = _length_format(max(lengths))
+    return fmt.encode() + struct.pack(f'>{len(lengths)}{fmt}', *lengths)
+
+def _column_to_bytes(tag: int, column: tuple) -> bytes:
+    fmt, is_variable = _SPEC_BY_TAG[tag][1:3]
+    if tag == _NONE_TAG:
+        return b''
+    if tag == _INT_TAG:
+        fmt = _int_format(min(column), max(column))
+        return fmt.encode() + struct.pack(f'>{len(column)}{fmt}', *column)
+    if tag == _DATE_TAG:
+        column = [value.toordinal() for value in column]
+    if not is_variable:
+        return struct.pack(f'>{len(column)}{fmt}', *column)
+    if tag == _STR_TAG:
+        text = ''.join(column)
+        blob = text.encode('utf-8')
+        if len(blob) == len(text):  # ascii only, the byte lengths equal the string lengths
+            return _lengths_to_bytes(list(map(len, column))) + blob
+        raws = [value.encode('utf-8') for value in column]
+    elif tag == _DATETIME_TAG:
+        raws = [value.isoformat().encode('utf-8') for value in column]
+    else:
+        raws = column
+    return _lengths_to_bytes(list(map(len, raws))) + b''.join(raws)
+
+def _column_from_bytes(tag: int, n_rows: int, buffer: memoryview, offset: int) -> tuple[Any, int]:
+    """Returns the values of the column (any iterable of length n_rows) and the offset after the column"""
+    fmt, is_variable, decode = _SPEC_BY_TAG[tag][1:4]
+    if tag == _NONE_TAG:
+        return repeat(None, n_rows), offset
+    if tag == _INT_TAG:
+        fmt = chr(buffer[offset])
+        offset += 1
+    if fmt in _ARRAY_FORMATS and tag != _DATE_TAG:
+        column = array(fmt)
+        end = offset + column.itemsize * n_rows
+        column.frombytes(buffer[offset:end])
+        if sys.byteorder == 'little' and column.itemsize > 1:
+            column.byteswap()
+        return column, end
+    if not is_variable:
+        column = struct.unpack_from(f'>{n_rows}{fmt}', buffer, offset)
+        offset += struct.calcsize(f'>{n_rows}{fmt}')
+        if tag == _DATE_TAG:
+            column = map(date.fromordinal, column)
+        return column, offset
+    fmt = chr(buffer[offset])
+    offset += 1
+    lengths = struct.unpack_from(f'>{n_rows}{fmt}', buffer, offset)
+    offset += struct.calcsize(f'>{n_rows}{fmt}')
+    end = offset + sum(lengths)
+    blob = buffer[offset:end]
+    bounds = list(accumulate(lengths, initial=0))
+    if tag == _STR_TAG:
+        text = str(blob, 'utf-8')
+        if len(text) == len(blob):  # ascii only, character offsets equal byte offsets
+            intern = sys.intern
+            return [intern(text[a:b]) for a, b in zip(bounds, bounds[1:])], end
+    return [decode(blob[a:b]) for a, b in zip(bounds, bounds[1:])], end
+
+def _dumps_columnar(data: list | tuple) -> bytes | None:
+    """Columnar encoding of the rows, None if the rows do not share the same tags"""
+    if not data or type(data[0]) is not tuple:
+        return None
+    first = data[0]
+    n_cols = len(first)
+    try:
+        tags = b''.join([_TAG_BY_TYPE[type(value)] for value in first])
+    except KeyError:
+        return None
+    if set(map(type, data)) != {tuple} or set(map(len, data)) != {n_cols}:
+        return None
+    columns = list(zip(*data)) if n_cols else []
+    for typ, column in zip(map(type, first), columns):
+        if set(map(type, column)) != {typ}:
+            return None
+    try:
+        parts = [_column_to_bytes(tag, column) for tag, column in zip(tags, columns)]
+    except struct.error:  # e.g. an int that does not fit in 64 bits
+        return None
+    magic = COLUMNAR_LIST_MAGIC if type(data) is list else COLUMNAR_TUPLE_MAGIC
+    return magic + _ROW_COUNT.pack(len(data)) + _COUNT.pack(n_cols) + tags + b''.join(parts)
+
+class ColumnarLength:
+    """Length of dumps(rows) while the rows share the same tags and use the columnar layout. It is
+    kept up to date one row at a time, a page then knows how full it is without serializing its rows.
+    Per column it holds the smallest and largest int, or the longest variable length value."""
+    __slots__ = ('types', 'n_rows', 'lows', 'highs', 'var_bytes', 'length')
+
+    def __init__(self, types: tuple = (), n_rows: int = 0, lows: tuple = (), highs: tuple = (), var_bytes: int = 0):
+        self.types = types
+        self.n_rows = n_rows
+        self.lows = lows
+        self.highs = highs
+        self.var_bytes = var_bytes
+        self.length = self._length()
+
+    @classmethod
+    def of(cls, rows: list | tuple) -> 'ColumnarLength | None':
+        """None if the rows do not use the columnar layout"""
+        state = cls()
+        for row in rows:
+            state = state.with_row(row)
+            if state is None:
+                return None
+        return state
+
+    def with_row(self, row: Any) -> 'ColumnarLength | None':
+        """The length after appending row, None if the rows then no longer use the columnar layout"""
+        if type(row) is not tuple:
+            return None
+        types = tuple(map(type, row))
+        if self.n_rows and types != self.types:
+            return None
+        try:
+            measures = tuple([_MEASURE_BY_TYPE[typ](value) for typ, value in zip(types, row)])
+        except KeyError:
+            return None
+        var_bytes = self.var_bytes + sum([size for typ, size in zip(types, measures) if FIELD_TYPES[typ][2]])
+        if self.n_rows:
+            lows, highs = tuple(map(min, self.lows, measures)), tuple(map(max, self.highs, measures))
+        else:
+            lows = highs = measures
+        try:
+            return ColumnarLength(types, self.n_rows + 1, lows, highs, var_bytes)
+        except struct.error:  # an int that does not fit in 64 bits
+            return None
+
+    def _length(self) -> int:
+        n_rows = self.n_rows
+        if not n_rows:
+            return len(LIST_MAGIC)
+        length = len(COLUMNAR_LIST_MAGIC) + _ROW_COUNT.size + _COUNT.size + len(self.types) + self.var_bytes
+        for typ, low, high in zip(self.types, self.lows, self.highs):
+            fmt, is_variable = FIELD_TYPES[typ][1:3]
+            if typ is int:
+                length += 1 + _WIDTH[_int_format(low, high)] * n_rows
+            elif is_variable:
+                length += 1 + _WIDTH[_length_format(high)] * n_rows
+            else:
+                length += _WIDTH[fmt] * n_rows
+        return length
+
+def _loads_columnar(buffer: memoryview) -> list[tuple]:
+    (n_rows,) = _ROW_COUNT.unpack_from(buffer, 1)
+    (n_cols,) = _COUNT.unpack_from(buffer, 1 + _ROW_COUNT.size)
+    offset = 1 + _ROW_COUNT.size + _COUNT.size
+    tags = bytes(buffer[offset:offset + n_cols])
+    offset += n_cols
+    if not n_cols:
+        return [()] * n_rows
+    columns = []
+    for tag in tags:
+        column, offset = _column_from_bytes(tag, n_rows, buffer, offset)
+        columns.append(column)
+    return list(zip(*columns))
+
+def dumps(data: Any) -> bytes:
+    """Serialize the data of a page. Sequences of rows use the columnar or row layout, everything else is pickled."""
+    if type(data) is list or type(data) is tuple:
+        columnar = _dumps_columnar(data)
+        if columnar is not None:
+            return columnar
+        magic = LIST_MAGIC if type(data) is list else TUPLE_MAGIC
+        try:
+            return magic + b''.join([encode_row(row) for row in data])
+        except RowFormatError:
+            pass
+    return pickle.dumps(data)
+
+def loads(buffer) -> Any:
+    """Inverse of dumps. buffer can be any bytes like object."""
+    buffer = memoryview(buffer)
+    if buffer[0] == PICKLE_MAGIC:
+        return pickle.loads(buffer)
+    magic = bytes(buffer[:1])
+    if magic == COLUMNAR_LIST_MAGIC:
+        return _loads_columnar(buffer)
+    if magic == COLUMNAR_TUPLE_MAGIC:
+        return tuple(_loads_columnar(buffer))
+    if magic not in (LIST_MAGIC, TUPLE_MAGIC):
+        raise ValueError(f"Unknown page format {magic!r}")
+    rows = []
+    offset = 1
+    end = len(buffer)
+    while offset < end:
+        (n,) = _COUNT.unpack_from(buffer, offset)
+        offset += _COUNT.size
+        tags = bytes(buffer[offset:offset + n])
+        row, offset = _get_codec(tags).unpack_from(buffer, offset + n)
+        rows.append(row)
+    return tuple(rows) if magic == TUPLE_MAGIC else rows
@@ -3,6 +3,7 @@ from errors import NamingError, SQLSyntaxError, ValidationError, TableNotFoundEr
 from typing import Tuple, List
 from syntax_tree import DeleteStatement, Expression, SelectStatement, Literal, ColumnRef, AggregateCall, SortItem, OrderByClause, GroupByClause, LimitClause, Join, TableRef, Star, BinaryOp, CreateStatement, InsertStatement, DropStatement, BeginStatement, CommitStatement, RollbackStatement, ASTNode
 import re
+import sys
 
 class qtransaction(StrEnum):
     BEGIN = 'BEGIN'
@@ -88,63 +89,88 @@ PRECEDENCE = {
 }
 
 token_separators = [e.value for e in qarithmaticoperators] + [e.value for e in qseparators] + [e.value for e in qcomparators] + [e.value for e in qwhitespaces] + [e.value for e in qtransaction]
-keywords_set = set([e.value for e in qtype] + [e.value for e in qtrans] + [e.value for e in qddl] + [e.value for e in qtypes] + [e.value for e in qtransaction])
-whitespaces_set = set([e.value for e in qwhitespaces])
+token_separators = tuple(sorted(token_separators, key=len, reverse=True))  # iterated to match with tokens. Longest tokens should go first
+keywords_set = frozenset([e.value for e in qtype] + [e.value for e in qtrans] + [e.value for e in qddl] + [e.value for e in qtypes] + [e.value for e in qtransaction])
+whitespaces_set = frozenset([e.value for e in qwhitespaces])
+transaction_set = frozenset([e.value for e in qtransaction])
+aggregates_set = frozenset([qtrans.COUNT.value, qtrans.MIN.value, qtrans.MAX.value, qtrans.AVG.value, qtrans.SUM.value])
+# the tokenizer emits these canonical (interned) objects for keywords and separators, so comparing
+# tokens and looking them up in sets and dicts mostly hits the identity shortcut
+_canonical_tokens = {sys.intern(token): sys.intern(token) for token in keywords_set | set(token_separators)}
 
 comparators_arithmatic_symbols = set([e.value for e in qcomparators] + [e.value for e in qarithmaticoperators])
 
 type_set = set([e.value for e in qtypes])
 
-def tokenize(query: str) -> list[str]:
-    """The goal is to split the function by whitespace, comma, dot and semicolon."""
-
-    token_separators.sort(key=lambda s: len(s), reverse=True)  # this list is iterated to match with tokens. Longest tokens should go first
+# a literal runs to the first quote that is not escaped with a backslash. Any other text runs up to
+# the next separator or quote. Matching longest separators first keeps '<=' from being split
+_separators_pattern = '|'.join(map(re.escape, token_separators))
+_TOKEN_RE = re.compile(
+    rf"(?P<literal>'.*?(?<!\\)')|(?P<separator>{_separators_pattern})|(?P<word>(?:(?!{_separators_pattern}|').)+)|(?P<unclosed>')",
+    re.DOTALL)
 
+def tokenize(query: str) -> list[str]:
+    """The goal is to split the function by whitespace, comma, dot and semicolon.
+    All scanning is done by a single compiled regex, python only sees every token once."""
     tokens = []
-    char_index = 0
-    prev_char_index = char_index
-    while char_index < len(query):
-        if query[char_index] == r"'":
-            # literal detection
-            # look ahead for the closing quote
-            start_quote_index = char_index
-            char_index += 1
-            while char_index < len(query) and not (query[char_index] == "'" and query[char_index-1] != "\\"):  # escape ' is handled this way. -1 is safe because the cursor has advanced by one in prev line
-                char_index += 1
-            if char_index == len(query):
-                raise SQLSyntaxError("Unclosed string literal in query.")
-
-            literal_token = query[start_quote_index : char_index + 1]
-            tokens.append(literal_token)
-            
-            char_index += 1 # Move past the closing quote
-            prev_char_index = char_index
-            continue
-
-        # check for separator 
-        # nested loop hurts a bit but performance gains in tokenizer are tiny compared to overal performance
-        for k in token_separators:
-            if len(query) >= char_index+len(k) and query[char_index:char_index+len(k)] == k:
-                # append previous token
-                token = query[prev_char_index:char_index]
-                if token != '':
-                    tokens.append(token if token.upper() not in keywords_set else token.upper())
-                if k not in whitespaces_set:
-                    tokens.append(k)
-                char_index += len(k)
-                prev_char_index = char_index
-                break
+    for match in _TOKEN_RE.finditer(query):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == 'word':
+            keyword = _canonical_tokens.get(token.upper())
+            tokens.append(keyword if keyword is not None else sys.intern(token))
+        elif kind == 'separator':
+            if token not in whitespaces_set:
+                tokens.append(_canonical_tokens[token])
+        elif kind == 'literal':
+            tokens.append(token)
         else:
-            char_index += 1
-
-    token = query[prev_char_index:char_index]
-    if token != '':
-        tokens.append(token if token.upper() not in keywords_set else token.upper())
+            raise SQLSyntaxError("Unclosed string literal in query.")
     return tokens
        
 
+_FLOAT_RE = re.compile(r'\d*[.]\d+')
+
+def is_literal(token: str) -> bool:
+    return token.startswith("'") or token.isdigit() or _FLOAT_RE.match(token) is not None
+
+def literal_value(token: str) -> str | int | float:
+    """The python value of a literal token"""
+    if token.startswith("'") and token.endswith("'"):
+        return sys.intern(token.strip("'").replace(r"\'", "'"))  # interned like the strings read from pages
+    if token.isdigit():
+        return int(token)
+    if _FLOAT_RE.match(token):
+        return float(token)
+    return token
+
+# a literal of every type that stands in for the actual value in a parameterized statement
+PARAMETER_TOKENS = {str: "''", int: '0', float: '0.0'}
+
+def parameterize(tokens: list[str]) -> tuple[tuple[str, ...], list]:
+    """Replace the literals by a placeholder literal of the same type. Statements that only differ
+    in their constants get the same shape, so they can share one parse. Returns the shape and the
+    values of the replaced literals in order. The LIMIT count is kept since the parser consumes it."""
+    shape = []
+    params = []
+    prev = None
+    for token in tokens:
+        if prev != qtrans.LIMIT and is_literal(token):
+            value = literal_value(token)
+            shape.append(PARAMETER_TOKENS[type(value)])
+            params.append(value)
+        else:
+            shape.append(token)
+        prev = token
+    return tuple(shape), params
+
+
 class TokenStream:
     def __init__(self, tokens):
+        self.reset(tokens)
+
+    def reset(self, tokens):
+        """Start over on new tokens, so one stream can be reused for every query"""
         self.tokens = tokens
         self.pos = 0
 
@@ -174,14 +200,19 @@ class TokenStream:
 class Parser:
     
     def __init__(self, ts: TokenStream):
+        self.reset(ts)
+
+    def reset(self, ts: TokenStream):
+        """Start over on a new (or reset) token stream"""
         self.stream = ts
+        self.literals: list[Literal] = []  # the literal nodes in the order they appear in the query
 
     def parse(self):
         """Entry point: Parses a single SQL statement."""
         
         current_token = self.stream.current()
 
-        if current_token in [e.value for e in qtransaction]:
+        if current_token in transaction_set:
             return self._parse_transaction_modifier()
 
         if current_token == qtype.SELECT:
@@ -443,6 +474,7 @@ class Parser:
         
         if not isinstance(limit_operand, Literal):
              raise SQLSyntaxError("LIMIT must be followed by a numeric literal.")
+        self.literals.pop()  # the count is not kept as a node
                 
         return LimitClause(limit_operand.value)    
 
@@ -496,7 +528,7 @@ class Parser:
             return Star()
 
         # Check for aggregates
-        if token in ['COUNT', 'MIN', 'MAX', 'AVG', 'SUM']:
+        if token in aggregates_set:
             function_name = self.stream.match(token)
             self.stream.match('(')
             is_distinct = False 
@@ -518,7 +550,7 @@ class Parser:
     
 
     def _is_literal(self, token: str) -> bool:
-        return token.startswith("'") or token.isdigit() or re.match(r'\d*[.]\d+', token)
+        return is_literal(token)
 
 
     def _parse_alias(self) -> None | str:
@@ -556,15 +588,10 @@ class Parser:
         token: None | str = self.stream.current()
         if token is None:
             raise SQLSyntaxError("Expected literal value not end of query")
-        value: str | int | float = token
-        if token.startswith("'") and token.endswith("'"):
-            value = str(token.strip("'").replace(r"\'", "'"))
-        elif token.isdigit():
-            value = int(token)
-        elif re.match(r'\d*[.]\d+', token):
-            value = float(token)
         self.stream.advance()
-        return Literal(value)
+        literal = Literal(literal_value(token))
+        self.literals.append(literal)
+        return literal
 
     def _parse_operand(self) -> ColumnRef | Literal:
         """
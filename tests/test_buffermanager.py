@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import MagicMock
 from buffermanager import BufferManager
-from catalog import Page
+from catalog import Page, ShadowPage
 
 @pytest.fixture
 def mock_disk_manager():
@@ -112,7 +112,7 @@ def test_flush_writes_all_dirty(buffer_manager, mock_disk_manager):
     
     buffer_manager.flush()
     
-    assert mock_disk_manager.write_page.call_count == 2
+    mock_disk_manager.write_pages.assert_called_once_with([p1, p2])
     # Ensure they are still in buffer
     assert 1 in buffer_manager.buffer
     assert 2 in buffer_manager.buffer
@@ -152,3 +152,143 @@ def test_capacity_zero_behavior(mock_disk_manager):
     
     assert 1 not in bm.buffer
     mock_disk_manager.write_page.assert_called_once_with(p1)
+
+def test_put_existing_page_refreshes_lru(buffer_manager, mock_disk_manager):
+    """Test that re-putting a cached page makes it the most recently used."""
+    p1 = Page(1, [], is_dirty=False)
+    p2 = Page(2, [], is_dirty=False)
+    buffer_manager.put(p1)
+    buffer_manager.put(p2)
+
+    buffer_manager.put(Page(1, [], is_dirty=False))
+    buffer_manager.put(Page(3, [], is_dirty=False))
+
+    assert 1 in buffer_manager.buffer
+    assert 3 in buffer_manager.buffer
+    assert 2 not in buffer_manager.buffer
+
+def test_get_pages_prefetches_misses(buffer_manager, mock_disk_manager):
+    """Test get_pages hints the disk manager about all pages it will read."""
+    buffer_manager.put(Page(1, []))
+    mock_disk_manager.read_page.side_effect = [Page(2, []), Page(3, [])]
+
+    list(buffer_manager.get_pages([1, 2, 3]))
+
+    mock_disk_manager.prefetch.assert_called_once_with([2, 3])
+
+def test_get_pages_reads_misses_in_disk_order(buffer_manager, mock_disk_manager):
+    """Test that pages missing from the buffer are read in ascending page_id order."""
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [])
+
+    pages = list(buffer_manager.get_pages([7, 3, 5]))
+
+    assert [p.page_id for p in pages] == [3, 5, 7]
+
+def test_sequential_reads_trigger_readahead(buffer_manager, mock_disk_manager):
+    """Test that a run of consecutive disk reads prefetches the following pages."""
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [])
+
+    for pid in [1, 2, 3]:
+        buffer_manager.get_page(pid)
+    mock_disk_manager.prefetch.assert_not_called()
+
+    buffer_manager.get_page(4)
+    mock_disk_manager.prefetch.assert_called_once_with(range(5, 13))
+
+    # inside the prefetched window no new hint is given
+    buffer_manager.get_page(5)
+    mock_disk_manager.prefetch.assert_called_once()
+
+def test_random_reads_do_not_trigger_readahead(buffer_manager, mock_disk_manager):
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [])
+
+    for pid in [5, 1, 9, 2, 7]:
+        buffer_manager.get_page(pid)
+
+    mock_disk_manager.prefetch.assert_not_called()
+
+def test_get_pages_deduplicates_page_ids(buffer_manager, mock_disk_manager):
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [])
+
+    pages = list(buffer_manager.get_pages([2, 1, 2, 1]))
+
+    assert sorted(p.page_id for p in pages) == [1, 2]
+    assert mock_disk_manager.read_page.call_count == 2
+
+def test_scan_does_not_evict_hot_pages(mock_disk_manager):
+    """Test that pages accessed twice survive a scan over many pages read once (2Q)."""
+    bm = BufferManager(mock_disk_manager, capacity=4)
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [], is_dirty=False)
+    bm.get_page(1)
+    bm.get_page(1)
+    bm.get_page(2)
+    bm.get_page(2)
+
+    for pid in range(10, 30):
+        bm.get_page(pid)
+
+    assert 1 in bm.buffer
+    assert 2 in bm.buffer
+    assert 29 in bm.buffer
+    assert len(bm.buffer) == 4
+
+def test_pinned_page_is_never_evicted(buffer_manager, mock_disk_manager):
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [], is_dirty=False)
+    catalog_page = buffer_manager.pin(0)
+
+    for pid in range(1, 10):
+        buffer_manager.get_page(pid)
+
+    assert buffer_manager.get_page(0) is catalog_page
+    assert 0 in buffer_manager.buffer
+    assert mock_disk_manager.read_page.call_count == 10
+
+def test_unpin_returns_page_to_replacement(buffer_manager, mock_disk_manager):
+    mock_disk_manager.read_page.side_effect = lambda pid: Page(pid, [], is_dirty=False)
+    buffer_manager.get_page(1)
+    buffer_manager.pin(1)
+    buffer_manager.unpin(1)
+
+    for pid in range(2, 5):
+        buffer_manager.get_page(pid)
+
+    assert 1 not in buffer_manager.buffer
+
+def test_flush_only_writes_dirty_pages_once(buffer_manager, mock_disk_manager):
+    """Test flush marks the written pages clean so a second flush writes nothing."""
+    p1 = Page(1, [], is_dirty=True)
+    p2 = Page(2, [], is_dirty=False)
+    buffer_manager.put(p1)
+    buffer_manager.put(p2)
+
+    buffer_manager.flush()
+    buffer_manager.flush()
+
+    mock_disk_manager.write_pages.assert_called_once_with([p1])
+    assert p1.is_dirty is False
+
+def test_flush_writes_shadow_page_changed_after_flush(buffer_manager, mock_disk_manager):
+    """Test that a shadow page changed after a flush is written by the next flush."""
+    shadow = ShadowPage(1, [])
+    buffer_manager.put(shadow)
+    buffer_manager.flush()
+
+    shadow.add_row((1,))
+    buffer_manager.flush()
+
+    assert mock_disk_manager.write_pages.call_count == 2
+    mock_disk_manager.write_pages.assert_called_with([shadow])
+
+def test_flush_writes_pinned_catalog_page_with_data_pages(buffer_manager, mock_disk_manager):
+    """Test that a new version of a pinned page is flushed in one batch with the other dirty pages."""
+    mock_disk_manager.read_page.return_value = Page(0, [], is_dirty=False)
+    buffer_manager.pin(0)
+    p1 = Page(1, [], is_dirty=True)
+    buffer_manager.put(p1)
+    catalog_page = Page(0, [(1,)], is_dirty=True)
+    buffer_manager.put(catalog_page)
+
+    buffer_manager.flush()
+
+    mock_disk_manager.write_pages.assert_called_once_with([catalog_page, p1])
+    mock_disk_manager.write_page.assert_not_called()
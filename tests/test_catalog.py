@@ -1,5 +1,5 @@
 import pytest
-from catalog import Catalog, Table, Page
+from catalog import Catalog, Table, Page, ShadowPage
 from tests.test_transaction import transaction
 
 @pytest.fixture
@@ -92,3 +92,60 @@ def test_get_table_case_insensitive(empty_catalog):
     
     fetched = empty_catalog.get_table_by_name("uSeRs")
     assert fetched == t
+
+def test_return_page_ids_deduplicates(empty_catalog):
+    """Test that returning the same page id twice does not hand it out twice."""
+    empty_catalog.return_page_ids([5, 3])
+    empty_catalog.return_page_ids([3, 5])
+
+    assert sorted(empty_catalog.free_page_ids) == [3, 5]
+    assert empty_catalog.get_free_page_id(transaction_id=1) == 3
+    assert empty_catalog.get_free_page_id(transaction_id=1) == 5
+    assert empty_catalog.get_free_page_id(transaction_id=1) == 1
+
+def test_free_list_survives_serialization(populated_catalog):
+    populated_catalog.return_page_ids([7])
+    page = Page.from_bytes(0, populated_catalog.to_page().to_bytes())
+    restored = Catalog.from_page(page)
+
+    restored.return_page_ids([7, 3])
+    assert sorted(restored.free_page_ids) == [3, 7]
+
+def test_held_page_ids_are_freed_by_the_last_reader(populated_catalog):
+    page_ids = populated_catalog.get_table_by_name("t1").page_id
+    populated_catalog.hold_page_ids(page_ids)
+    populated_catalog.hold_page_ids(page_ids)
+    populated_catalog.return_page_ids([1, 2, 5])
+    assert sorted(populated_catalog.free_page_ids) == [3, 5]
+
+    restored = Catalog.from_page(Page.from_bytes(0, populated_catalog.to_page().to_bytes()))
+    assert sorted(restored.free_page_ids) == [1, 2, 3, 5]  # nothing is read after a restart
+
+    populated_catalog.release_page_ids(page_ids)
+    assert sorted(populated_catalog.free_page_ids) == [3, 5]
+    populated_catalog.release_page_ids(page_ids)
+    assert sorted(populated_catalog.free_page_ids) == [1, 2, 3, 5]
+
+def test_page_column_is_built_once():
+    page = Page(1, [(1, 'a'), (2, 'b')])
+    assert page.column(1) == ('a', 'b')
+    assert page.column(1) is page.column(1)
+
+def test_shadow_page_column_follows_changes():
+    page = ShadowPage(1, [(1, 'a')])
+    assert page.column(0) == (1,)
+    page.add_row((2, 'b'))
+    assert page.column(0) == (1, 2)
+
+def test_pages_have_no_instance_dict():
+    assert not hasattr(Page(1, [(1, 'a')]), '__dict__')
+    assert not hasattr(ShadowPage(1, [(1, 'a')]), '__dict__')
+
+def test_shadow_page_add_rows_stops_when_full():
+    rows = [(i, 'x' * 1000) for i in range(40)]
+    page = ShadowPage(1, [])
+    added = page.add_rows(rows)
+    assert 0 < added < len(rows)
+    assert page.data == rows[:added]
+    assert not page.add_row(rows[added])
+    assert list(Page.from_bytes(1, page.to_bytes()).data) == rows[:added]
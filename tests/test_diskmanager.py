@@ -123,3 +123,23 @@ def test_is_dirty_flag_respected(db_file):
     p_read = dm.read_page(1)
     # When read from disk, is_dirty is False (default in from_bytes)
     assert p_read.is_dirty is False
+
+def test_write_pages_batch(db_file):
+    """Test that a batch write with a gap in the page_ids persists every page."""
+    dm = DiskManager(db_file)
+    pages = [Page(3, ["p3"]), Page(1, ["p1"]), Page(2, ["p2"]), Page(5, ["p5"])]
+
+    dm.write_pages(pages)
+
+    for page in pages:
+        assert dm.read_page(page.page_id).data == page.data
+
+def test_prefetch_does_not_change_data(db_file):
+    """Test that prefetching (also past the end of the file) is only a hint."""
+    dm = DiskManager(db_file)
+    dm.write_pages([Page(1, ["a"]), Page(2, ["b"]), Page(4, ["d"])])
+
+    dm.prefetch([4, 1, 2, 7])
+
+    assert dm.read_page(2).data == ["b"]
+    assert dm.read_page(4).data == ["d"]
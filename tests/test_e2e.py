@@ -176,3 +176,45 @@ def test_failed_query_no_side_effects(db_engine):
     
     res = db_engine.execute(QueryRequest("SELECT COUNT(*) FROM strict;"))
     assert res.rows == [(1,)]
+
+def test_streaming_select_survives_commit_that_reuses_pages(db_engine):
+    """11. A paused streaming SELECT keeps reading the rows it started on, also when a commit frees
+    its pages and the next insert gets their page ids."""
+    db_engine.execute(QueryRequest("CREATE TABLE t (id INT, note TEXT);"))
+    values = ", ".join(f"({i}, 'old {'o' * 40}')" for i in range(3000))
+    db_engine.execute(QueryRequest(f"INSERT INTO t VALUES {values};"))
+    assert len(db_engine.catalog.get_table_by_name("t").page_id) > 1
+
+    stream = db_engine.execute(QueryRequest("SELECT id, note FROM t;", streaming=True)).rows
+    first = [next(stream) for _ in range(5)]
+    db_engine.execute(QueryRequest("DELETE FROM t WHERE id >= 0;"))
+    values = ", ".join(f"({i}, 'new {'n' * 40}')" for i in range(1000))
+    db_engine.execute(QueryRequest(f"INSERT INTO t VALUES {values};"))
+
+    rows = first + list(stream)
+    assert sorted(id for id, _ in rows) == list(range(3000))
+    assert all(note.startswith('old') for _, note in rows)
+
+    res = db_engine.execute(QueryRequest("SELECT COUNT(*), MIN(note) FROM t;"))
+    assert res.rows == [(1000, 'new ' + 'n' * 40)]
+    assert not db_engine.catalog._held_free_page_ids
+
+def test_streaming_select_reads_the_tables_committed_when_it_started(db_engine):
+    """12. The snapshot is taken when the SELECT is executed, not when its first row is read."""
+    db_engine.execute(QueryRequest("CREATE TABLE t (id INT, note TEXT);"))
+    values = ", ".join(f"({i}, 'old {'o' * 40}')" for i in range(3000))
+    db_engine.execute(QueryRequest(f"INSERT INTO t VALUES {values};"))
+
+    stream = db_engine.execute(QueryRequest("SELECT id FROM t;", streaming=True)).rows
+    abandoned = db_engine.execute(QueryRequest("SELECT id FROM t;", streaming=True)).rows
+    never_read = db_engine.execute(QueryRequest("SELECT id FROM t;", streaming=True)).rows
+    db_engine.execute(QueryRequest("DELETE FROM t WHERE id >= 0;"))
+    values = ", ".join(f"({i}, 'new {'n' * 40}')" for i in range(1000))
+    db_engine.execute(QueryRequest(f"INSERT INTO t VALUES {values};"))
+
+    assert sorted(stream) == [(i,) for i in range(3000)]
+    assert next(abandoned) in [(i,) for i in range(3000)]
+    abandoned.close()
+    del never_read
+    assert not db_engine.catalog._readers
+    assert not db_engine.catalog._held_free_page_ids
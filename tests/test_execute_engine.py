@@ -697,3 +697,127 @@ def test_float_and_string_comparison(engine):
     results = execute_query_and_get_results(engine, query)
     # NY salary > 59999.99: Alice (1, 60k), Grace (7, 80k)
     assert results == [(1,), (7,)]
+
+def test_repeated_query_reuses_parse(engine):
+    """Test that the same sql text is only parsed once and still gives the same result."""
+    query = "SELECT name FROM employee WHERE id = 2;"
+    first = engine.execute(QueryRequest(query, -1))
+    second = engine.execute(QueryRequest(query, -1))
+    assert first.ast is second.ast
+    assert first.rows == second.rows == [('Bob',)]
+
+def test_queries_differing_in_literals_share_parse(engine):
+    """Test that the literals of a statement are bound into a copy of the shared parse, so the AST
+    of an earlier result keeps its values."""
+    first = engine.execute(QueryRequest("SELECT name FROM employee WHERE id = 2;", -1))
+    assert first.rows == [('Bob',)]
+    second = engine.execute(QueryRequest("SELECT name FROM employee WHERE id = 4;", -1))
+    assert second.rows == [('Dave',)]
+    assert first.ast.where_clause.right.value == 2
+    assert second.ast.where_clause.right.value == 4
+    assert first.ast.from_clause is second.ast.from_clause  # the parts without literals are shared
+
+def test_syntax_error_quotes_the_typed_token(engine):
+    """Test that a syntax error in a parameterized statement names the literal as it was written."""
+    result = engine.execute(QueryRequest("SELECT name FROM employee WHERE id = -2;", -1))
+    assert "got '2'" in result.error
+
+def test_limit_is_not_parameterized(engine):
+    """Test that statements with a different LIMIT count are parsed separately."""
+    assert len(execute_query_and_get_results(engine, "SELECT id FROM employee LIMIT 2;")) == 2
+    assert len(execute_query_and_get_results(engine, "SELECT id FROM employee LIMIT 3;")) == 3
+
+def test_terminated_transaction_is_reused(engine):
+    """Test that a committed transaction object is reset and reused for the next transaction."""
+    result = engine.execute(QueryRequest("BEGIN;", -1))
+    engine.execute(QueryRequest("COMMIT;", result.transaction_id))
+    transaction = engine._transaction_pool[-1]
+    transaction.shadow_tables['x'] = None
+
+    result = engine.execute(QueryRequest("BEGIN;", -1))
+    assert engine.get_transaction_by_id(result.transaction_id) is transaction
+    assert transaction.shadow_tables == {}
+
+def test_auto_commit_select_uses_read_only_transaction(engine):
+    """Test that an auto commit SELECT does not create a transaction."""
+    assert execute_query_and_get_results(engine, "SELECT id FROM employee WHERE id = 1;") == [(1,)]
+    assert not engine._transaction_pool
+    assert not engine.transactions
+
+def test_streaming_select_commits_when_exhausted(engine):
+    """Test that streamed rows are produced lazily and the anonymous transaction ends afterwards."""
+    result = engine.execute(QueryRequest("SELECT id FROM employee WHERE city = 'LA';", streaming=True))
+    assert result.rowcount is None
+    assert result.transaction_status == 'closed'
+    assert list(result.rows) == [(4,), (8,)]
+
+def test_syntax_error_reports_message_without_traceback(engine):
+    """Test that a parser error returns its message instead of a formatted traceback."""
+    result = engine.execute(QueryRequest("SELECT name FROM employee LIMIT x;", -1))
+    assert result.rows == [('Error',)]
+    assert result.error == "SQLSyntaxError: LIMIT must be followed by a numeric literal."
+
+def test_order_by_limit_top_k(engine):
+    """Test that ORDER BY with LIMIT keeps the order of ties and handles mixed directions."""
+    query = "SELECT name FROM employee ORDER BY age DESC LIMIT 3;"
+    assert execute_query_and_get_results(engine, query) == [('Dave',), ('Alice',), ('Grace',)]
+    query = "SELECT name FROM employee ORDER BY age ASC, name DESC LIMIT 3;"
+    assert execute_query_and_get_results(engine, query) == [('Eve',), ('Hank',), ('Fay',)]
+
+def test_group_by_across_aggregate_batches(engine, monkeypatch):
+    """Test that groups spread over several aggregation batches are combined."""
+    monkeypatch.setattr('operators.AGGREGATE_BATCH_SIZE', 2)
+    query = "SELECT city, COUNT(*), SUM(salary), MIN(age), MAX(age), COUNT(DISTINCT age) FROM employee GROUP BY city;"
+    results = execute_query_and_get_results(engine, query)
+    assert set(results) == {
+        ('NY', 4, 250000, 25, 30, 2),
+        ('SF', 2, 90000, 22, 22, 1),
+        ('LA', 2, 140000, 22, 40, 2),
+        ('BOS', 1, 30000, 19, 19, 1),
+    }
+
+def test_aggregate_states_skip_nulls():
+    """Test that the batch updates of the aggregate states ignore NULLs."""
+    from operators import SumState, CountState, MinState, AvgState
+    for values, expected in (([3, None, 1], (4, 2, 1, 2.0)), ([None], (0, 0, None, None))):
+        states = [SumState(), CountState(), MinState(), AvgState()]
+        for state in states:
+            state.update_many(values)
+        assert tuple(state.finalize() for state in states) == expected
+
+def test_count_star_over_filter(engine):
+    """Test COUNT(*) that is counted from the filter's page selection."""
+    assert execute_query_and_get_results(engine, "SELECT COUNT(*) FROM employee WHERE city = 'NY';") == [(4,)]
+    assert execute_query_and_get_results(engine, "SELECT COUNT(*) FROM employee WHERE age > 20 AND age < 30;") == [(5,)]
+    assert execute_query_and_get_results(engine, "SELECT COUNT(*) FROM employee WHERE salary + 1 > 70000;") == [(3,)]
+
+def test_join_with_spilled_right_side(engine, monkeypatch):
+    """Test that a nested loop join gives the same rows when most right rows are spilled to disk."""
+    query = "SELECT e.id, c.id FROM employee AS e JOIN contract AS c ON e.id > c.employee_id"
+    expected = execute_query_and_get_results(engine, query)
+    monkeypatch.setattr('operators.JOIN_MEMORY_ROWS', 1)
+    monkeypatch.setattr('operators.JOIN_SPILL_CHUNK_SIZE', 2)
+    monkeypatch.setattr('operators.JOIN_BLOCK_SIZE', 3)
+    assert sorted(execute_query_and_get_results(engine, query)) == sorted(expected)
+    assert len(expected) > 5
+
+def test_engines_do_not_share_a_parser(engine):
+    """Test that every engine parses with its own token stream and parser."""
+    other = DatabaseEngine(engine.catalog, engine.buffer_manager)
+    assert other._parser is not engine._parser and other._token_stream is not engine._token_stream
+    assert other.execute(QueryRequest("SELECT name FROM employee WHERE id = 2;", -1)).rows == [('Bob',)]
+    assert engine.execute(QueryRequest("SELECT name FROM employee WHERE id = 4;", -1)).rows == [('Dave',)]
+
+def test_distinct_without_column_indices():
+    """Test that a Distinct built from extractors only keys on the extracted values."""
+    from operator import itemgetter
+    from operators import Distinct
+
+    class Rows:
+        def next(self):
+            return iter([((1, 'a'), 1, 0), ((2, 'a'), 1, 1), ((1, 'a'), 1, 2)])
+        def rows(self):
+            return map(itemgetter(0), self.next())
+
+    assert list(Distinct([itemgetter(0)], Rows()).rows()) == [(1, 'a'), (2, 'a')]
+    assert list(Distinct([itemgetter(1)], Rows()).next()) == [((1, 'a'), 1, 0)]
@@ -68,10 +68,18 @@ def test_plan_aggregate_count():
 
 def test_plan_join_structure():
     schemas = {"t1": ["id"], "t2": ["id"]}
-    root = plan("SELECT * FROM t1 JOIN t2 ON t1.id = t2.id;", schemas)
+    root = plan("SELECT * FROM t1 JOIN t2 ON t1.id > t2.id;", schemas)
     # Projection -> NestedLoopJoin
     assert get_op_name(root.parent) == "NestedLoopJoin"
 
+def test_plan_equi_join_is_hash_join():
+    schemas = {"t1": ["id", "a"], "t2": ["b", "id"]}
+    join = plan("SELECT * FROM t1 JOIN t2 ON t2.id = t1.id AND t1.a > 1;", schemas).parent
+    assert get_op_name(join) == "HashJoin"
+    assert (join.left_keys, join.right_keys) == ([0], [1])
+    assert join.residual((1, 2, 0, 1)) and not join.residual((1, 1, 0, 1))
+    assert plan("SELECT * FROM t1 JOIN t2 ON t1.id = t2.id;", schemas).parent.residual is None
+
 def test_plan_insert_statement():
     # Use the manual planner call since plan() returns Select-based plans
     ast = Parser(TokenStream(tokenize("INSERT INTO users VALUES (1);"))).parse()
@@ -110,3 +118,109 @@ def test_plan_complex_group_by():
     while curr and get_op_name(curr) != "Aggregate":
         curr = getattr(curr, 'parent', None)
     assert curr is not None
+
+def test_plan_compiled_predicate():
+    root = plan("SELECT name FROM users WHERE id > 1 AND name != 'x' OR id = 0;", {"users": ["id", "name"]})
+    predicate = root.parent.predicate
+    assert predicate((2, 'a')) is True
+    assert predicate((2, 'x')) is False
+    assert predicate((0, 'x')) is True
+
+def test_plan_compiled_predicates_share_code_not_literals():
+    schemas = {"users": ["id", "name"]}
+    first = plan("SELECT name FROM users WHERE id = 1;", schemas).parent.predicate
+    second = plan("SELECT name FROM users WHERE id = 2;", schemas).parent.predicate
+    assert first.__code__ is second.__code__
+    assert first((1, 'a')) and not second((1, 'a'))
+
+def test_plan_column_comparison_filter():
+    schemas = {"users": ["id", "name"]}
+    root = plan("SELECT name FROM users WHERE 2 < id;", schemas)
+    index, compare, value = root.parent.column_comparison
+    assert index == 0 and value == 2
+    assert compare(3, value) and not compare(2, value)
+    root = plan("SELECT name FROM users WHERE id + 1 > 2;", schemas)
+    assert root.parent.column_comparison is None
+
+def test_plan_page_selector():
+    root = plan("SELECT name FROM users WHERE id > 1 AND name != 'x';", {"users": ["id", "name"]})
+    assert root.parent.page_selector([(2, 'a'), (1, 'a'), (3, 'x'), (4, 'b')]) == [0, 3]
+
+def test_plan_projection_of_plain_columns():
+    schemas = {"users": ["id", "name", "age"]}
+    root = plan("SELECT age, id FROM users;", schemas)
+    assert root.column_indices == [2, 0]
+    assert root._project((1, 'a', 30)) == (30, 1)
+    assert plan("SELECT name FROM users;", schemas)._project((1, 'a', 30)) == ('a',)
+    assert plan("SELECT * FROM users;", schemas)._project is None
+    assert plan("SELECT id + 1 FROM users;", schemas).column_indices is None
+
+def test_plan_logical_operands_are_not_wrapped_in_bool():
+    schemas = {"users": ["id", "name"]}
+    root = plan("SELECT name FROM users WHERE id > 1 AND name = 'x';", schemas)
+    assert 'bool' not in root.parent.predicate.__code__.co_names
+    assert root.parent.predicate((2, 'x')) is True
+    assert root.parent.predicate((2, 'y')) is False
+    assert plan("SELECT name FROM users WHERE id AND id > 1;", schemas).parent.predicate((0, 'x')) is False
+
+def test_plan_group_by_columns_use_itemgetter():
+    root = plan("SELECT city, SUM(salary) FROM users GROUP BY city;", {"users": ["city", "salary"]})
+    aggregate = root.parent
+    assert get_op_name(aggregate) == "Aggregate"
+    assert type(aggregate.group_extractors[0]).__name__ == 'itemgetter'
+    assert type(aggregate.specs[0].extractor).__name__ == 'itemgetter'
+
+def test_plan_logical_operands_are_reordered():
+    schemas = {"users": ["id", "name"]}
+    predicate = plan("SELECT name FROM users WHERE id != 3 AND id > 1 AND name = 'x';", schemas).parent.predicate
+    # constants are numbered in evaluation order: the equality runs first, the inequality last
+    assert [predicate.__globals__[name] for name in ('c0', 'c1', 'c2')] == ['x', 1, 3]
+    assert predicate((2, 'x')) is True
+    assert predicate((3, 'x')) is False
+    assert predicate((2, 'y')) is False
+
+def test_plan_aggregate_spec_columns():
+    root = plan("SELECT SUM(salary), COUNT(*), MAX(salary + 1) FROM users;", {"users": ["city", "salary"]})
+    assert [spec.column for spec in root.parent.specs] == [1, None, None]
+
+def test_plan_literal_comparisons_before_column_comparisons():
+    schemas = {"users": ["id", "name", "age"]}
+    ast = Parser(TokenStream(tokenize("SELECT name FROM users WHERE id > age AND age > 3 AND name = 'x';"))).parse()
+    schema = Schema([ColumnIdentifier(name=c) for c in schemas["users"]])
+    source = QueryPlanner(MockTransaction(schemas))._expression_source(ast.where_clause, schema, {})
+    assert source == '((row[1] == c0) and (row[2] > c1) and (row[0] > row[2]))'
+
+def test_plan_nested_loop_join_block_joiner():
+    join = plan("SELECT * FROM t1 JOIN t2 ON t1.a > t2.b;", {"t1": ["id", "a"], "t2": ["b"]}).parent
+    assert get_op_name(join) == "NestedLoopJoin"
+    assert join.block_joiner([(1, 5), (2, 1)], [(3,), (4,)]) == [(1, 5, 3), (1, 5, 4)]
+
+def test_plan_distinct_keys_on_whole_row():
+    root = plan("SELECT DISTINCT name, id FROM users;", {"users": ["id", "name"]})
+    assert get_op_name(root) == "Distinct"
+    assert root._key is None
+    assert list(root.rows()) == []
+
+def test_plan_computed_projection_is_one_function():
+    root = plan("SELECT id + 1, name, 'x' FROM users;", {"users": ["id", "name"]})
+    assert root.column_indices is None
+    assert root._project is root.project
+    assert root._project((1, 'a')) == (2, 'a', 'x')
+
+def test_plan_group_key_over_several_columns():
+    schemas = {"users": ["city", "age", "salary"]}
+    aggregate = plan("SELECT city, age, SUM(salary) FROM users GROUP BY city, age;", schemas).parent
+    assert type(aggregate._group_key).__name__ == 'itemgetter'
+    assert aggregate._group_key(('NY', 30, 1)) == ('NY', 30)
+
+def test_plan_sort_passes_use_one_key_function():
+    schemas = {"users": ["id", "name", "age"]}
+    sorter = plan("SELECT name FROM users ORDER BY name, id DESC, age;", schemas).parent
+    assert [is_descending for _, is_descending in sorter._passes] == [False, True, False]
+    sorter = plan("SELECT name FROM users ORDER BY name, age;", schemas).parent
+    row_key, _ = sorter._passes[0]
+    assert type(row_key).__name__ == 'itemgetter'
+    assert row_key((1, 'a', 30)) == ('a', 30)
+    sorter = plan("SELECT name FROM users ORDER BY age + 1, name;", schemas).parent
+    row_key, _ = sorter._passes[0]
+    assert row_key((1, 'a', 30)) == (31, 'a')
@@ -0,0 +1,110 @@
+import pickle
+from datetime import date, datetime
+
+import serializer
+from catalog import ShadowPage, Page, HEADER_SIZE, PAGE_SIZE
+
+def test_rows_round_trip_all_types():
+    rows = [(1, 'Alice', 30.5, None, True, b'raw', date(2025, 1, 1), datetime(2025, 1, 1, 12, 30)), (None,)]
+    data = serializer.dumps(rows)
+    assert data[:1] == serializer.LIST_MAGIC
+    assert serializer.loads(data) == rows
+
+def test_tuple_container_is_preserved():
+    rows = ((1, 'a'), (2, 'b'))
+    assert serializer.loads(serializer.dumps(rows)) == rows
+
+def test_unsupported_values_fall_back_to_pickle():
+    for data in (["not a row"], [(1, [1, 2])], [(2**70,)], {"a": 1}):
+        serialized = serializer.dumps(data)
+        assert serialized == pickle.dumps(data)
+        assert serializer.loads(serialized) == data
+
+def test_shadow_page_tracks_serialized_length():
+    page = ShadowPage(1, [])
+    for i in range(50):
+        assert page.add_row((i, f'name {i}'))
+        assert page._data_length == len(serializer.dumps(page.data))
+    page.delete_rows([0, 10, 20])
+    assert page._data_length == len(serializer.dumps(page.data))
+    assert page.add_row((None, 'diverging tags'))
+    assert page._data_length == len(serializer.dumps(page.data))
+    assert page.add_rows([(i, 'row layout') for i in range(10)]) == 10
+    assert page._data_length == len(serializer.dumps(page.data))
+
+def test_shadow_page_tracks_columnar_length_of_added_rows():
+    page = ShadowPage(1, [])
+    assert page.add_rows([(i * 1000, 'é' * (i % 3), i / 2) for i in range(200)]) == 200
+    assert serializer.dumps(page.data)[:1] == serializer.COLUMNAR_LIST_MAGIC
+    assert page._data_length == len(serializer.dumps(page.data))
+
+def test_shadow_page_holds_as_many_rows_as_pickle():
+    cities = ['Amsterdam', 'Berlin', 'Paris', 'London', 'New York']
+    rows = [(i, f'name {i}', 18 + i % 60, cities[i % 5], 1000 + i * 7) for i in range(5000)]
+    pickled = 0
+    while HEADER_SIZE + len(pickle.dumps(rows[:pickled + 1])) <= PAGE_SIZE:
+        pickled += 1
+    page = ShadowPage(1, [])
+    assert page.add_rows(rows) >= pickled
+    Page(1, tuple(page.data)).to_bytes()
+
+def test_shadow_page_fills_up_to_page_size():
+    page = ShadowPage(1, [])
+    while page.add_row((1, 'x' * 100)):
+        pass
+    assert HEADER_SIZE + len(serializer.dumps(page.data)) <= PAGE_SIZE
+    assert not page.has_space_for((1, 'x' * 100))
+    Page(1, tuple(page.data)).to_bytes()  # does not overflow
+
+def test_pickled_shadow_page_fills_up_to_page_size():
+    page = ShadowPage(1, ["not a row"])
+    while page.add_row(['y' * 100]):
+        pass
+    assert HEADER_SIZE + len(serializer.dumps(page.data)) <= PAGE_SIZE
+    assert len(serializer.dumps(page.data + [['y' * 100]])) + HEADER_SIZE > PAGE_SIZE
+    Page(1, page.data).to_bytes()
+
+def test_uniform_rows_use_columnar_layout():
+    rows = [(i, f'näme {i}', i * 1.5, date(2025, 1, i + 1), datetime(2025, 1, 1, i), b'x', True, None) for i in range(10)]
+    data = serializer.dumps(rows)
+    assert data[:1] == serializer.COLUMNAR_LIST_MAGIC
+    assert serializer.loads(data) == rows
+    assert serializer.loads(serializer.dumps(tuple(rows))) == tuple(rows)
+
+def test_rows_with_mixed_types_use_row_layout():
+    rows = [(1, 'a'), (None, 'b'), (3, 'c')]
+    data = serializer.dumps(rows)
+    assert data[:1] == serializer.LIST_MAGIC
+    assert serializer.loads(data) == rows
+
+def test_columnar_layout_round_trips_without_rows_or_columns():
+    for n_cols in range(0, 4):
+        for n_rows in range(0, 5):
+            rows = [tuple(range(n_cols))] * n_rows
+            assert serializer.loads(serializer.dumps(rows)) == rows
+
+def test_columnar_layout_is_not_larger_than_pickle():
+    cities = ['Amsterdam', 'Berlin', 'Paris', 'London', 'New York']
+    rows = [(i, f'name {i}', 18 + i % 60, cities[i % 5], 1000 + i * 7) for i in range(700)]
+    assert len(serializer.dumps(rows)) <= len(pickle.dumps(rows))
+
+def test_int_columns_use_the_narrowest_width():
+    for low, high in ((-128, 127), (-2**15, 2**15 - 1), (-2**31, 2**31 - 1), (-2**63, 2**63 - 1)):
+        rows = [(low, ''), (high, 'x' * 300)]
+        assert serializer.loads(serializer.dumps(rows * 4)) == rows * 4
+    narrow = serializer.dumps([(i, 'x') for i in range(100)])
+    wide = serializer.dumps([(i * 2**40, 'x') for i in range(100)])
+    assert len(wide) - len(narrow) == 100 * 7
+
+def test_shadow_page_with_mixed_rows_does_not_overflow():
+    page = ShadowPage(1, [])
+    i = 0
+    while page.add_row((i, 'x' * 50) if i % 7 else (None, 'x' * 50)):
+        i += 1
+    Page(1, tuple(page.data)).to_bytes()
+
+def test_decoded_strings_are_interned():
+    columnar = serializer.loads(serializer.dumps([(1, 'NY'), (2, 'NY')]))
+    assert columnar[0][1] is columnar[1][1]
+    rows = serializer.loads(serializer.dumps([(1, 'NY'), (2, None, 'NY')]))
+    assert rows[0][1] is rows[1][2]
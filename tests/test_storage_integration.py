@@ -7,6 +7,9 @@ from diskmanager import DiskManager
 from catalog import Catalog, PAGE_SIZE
 from request import QueryRequest
 from transaction import Transaction
+from enums import TransactionStatus
+from errors import ValidationError
+from queryplanner import QueryPlanner
 
 DB_FILE = "test_system.db"
 
@@ -251,3 +254,47 @@ def test_drop_table_restores_free_list(db_engine):
     # 3. Verify Page ID is free
     # (Note: Depends on if catalog recycles immediately or appends to list)
     assert used_page_id in db_engine.catalog.free_page_ids
+
+# 11. Mixed case table names
+def test_mixed_case_table_name_survives_commit(db_engine):
+    """Test that a table created with upper case letters can be used after the commit."""
+    db_engine.execute(QueryRequest("CREATE TABLE Users (id INT);"))
+    db_engine.execute(QueryRequest("INSERT INTO USERS VALUES (1);"))
+    db_engine.execute(QueryRequest("INSERT INTO users VALUES (2);"))
+
+    res = db_engine.execute(QueryRequest("SELECT * FROM uSeRs;"))
+    assert res.rows == [(1,), (2,)]
+
+def test_insert_column_subset_over_several_pages(db_engine):
+    db_engine.execute(QueryRequest("CREATE TABLE wide (id INT, name TEXT, note TEXT);"))
+    values = ", ".join(f"('{'n' * 200}', {i})" for i in range(300))
+    db_engine.execute(QueryRequest(f"INSERT INTO wide (name, id) VALUES {values};"))
+
+    assert len(db_engine.catalog.get_table_by_name("wide").page_id) > 1
+    res = db_engine.execute(QueryRequest("SELECT COUNT(*), SUM(id), MAX(note) FROM wide;"))
+    assert res.rows == [(300, 44850, None)]
+    res = db_engine.execute(QueryRequest("SELECT * FROM wide WHERE id = 7;"))
+    assert res.rows == [(7, 'n' * 200, None)]
+
+def test_validation_error_ends_auto_commit_transaction(db_engine, monkeypatch):
+    """A validation error of the planner comes after the auto commit transaction was acquired"""
+    def reject(planner, ast_root):
+        raise ValidationError("rejected while planning")
+    monkeypatch.setattr(QueryPlanner, 'plan_query', reject)
+    pooled = len(db_engine._transaction_pool)
+
+    res = db_engine.execute(QueryRequest("DELETE FROM anything;"))
+    assert res.error == "ValidationError: rejected while planning"
+    assert res.transaction_status == TransactionStatus.CLOSED
+    assert len(db_engine._transaction_pool) == pooled + 1
+
+def test_delete_over_more_pages_than_the_buffer_holds(db_engine):
+    """The shadow copies of the first pages are evicted while the delete scans the later pages"""
+    db_engine.execute(QueryRequest("CREATE TABLE big (id INT, note TEXT);"))
+    values = ", ".join(f"({i}, '{'n' * 200}')" for i in range(2000))
+    db_engine.execute(QueryRequest(f"INSERT INTO big VALUES {values};"))
+    assert len(db_engine.catalog.get_table_by_name("big").page_id) > db_engine.buffer_manager.capacity
+
+    db_engine.execute(QueryRequest("DELETE FROM big WHERE id >= 500;"))
+    res = db_engine.execute(QueryRequest("SELECT COUNT(*), MAX(id) FROM big;"))
+    assert res.rows == [(500, 499)]
@@ -5,6 +5,16 @@ from collections import defaultdict
 
 from errors import ValidationError
 
+def _read_pages(catalog: Catalog, buffer_manager: BufferManager, page_ids: tuple[int, ...]):
+    """Yield the pages while holding their page_ids. A streaming SELECT can be paused halfway while
+    another statement commits, the pages it still has to read must not be reused in the meantime."""
+    catalog.hold_page_ids(page_ids)
+    try:
+        yield from buffer_manager.get_pages(page_ids)
+    finally:
+        catalog.release_page_ids(page_ids)
+
+
 class Transaction:
     def __init__(self, id: int, buffer_manager, catalog):
         """The transaction class is a placeholder for catalog changes that are not yet committed. 
@@ -16,9 +26,13 @@ class Transaction:
         catalog. Thus 
         
         """
-        self.id = id
         self.buffer_manager: BufferManager = buffer_manager
         self.catalog: Catalog = catalog
+        self.reset(id)
+
+    def reset(self, id: int):
+        """Start over as a new transaction with this id, used to reuse terminated transactions"""
+        self.id = id
         # Keep track of which tables we modified so we can update them at commit
         self.shadow_tables: dict[str, None | ShadowTable] = {}  # None means table has been droped
         self.obtained_page_ids = set()  # in case of rollback, give these ids back
@@ -29,17 +43,21 @@ class Transaction:
         self.shadow_page_map: dict[int, int] = {}
 
     def get_table_by_name(self, name: str) -> Table | ShadowTable:
-        table: None | ShadowTable = self.shadow_tables.get(name.lower())
+        # shadow_tables is keyed on lowercase names, see Catalog.get_table_by_name
+        if name in self.shadow_tables:
+            table: None | ShadowTable = self.shadow_tables[name]
+        else:
+            table = self.shadow_tables.get(name.lower())
         if table: return table
         return self.catalog.get_table_by_name(name)
 
     def get_or_create_shadow_table(self, table: Table | ShadowTable) -> ShadowTable:
-        table_name = table.table_name
+        table_name = table.table_name.lower()
         if table_name not in self.shadow_tables and isinstance(table, Table):
             # copy the table and put it in the shadow table map
             # if the transaction is successfull this will be the new table object
             shadow_table: ShadowTable = table.to_shadow_table()
-            self.shadow_tables[shadow_table.table_name] = shadow_table
+            self.shadow_tables[table_name] = shadow_table
             return shadow_table
         shadow_table_or_none: None | ShadowTable = self.shadow_tables[table_name]
         if shadow_table_or_none is None:
@@ -61,7 +79,7 @@ class Transaction:
         
 
     def prepare_shadow_table_for_write(self, shadow_table: ShadowTable):
-        if not shadow_table.table_name in self.shadow_tables:
+        if not shadow_table.table_name.lower() in self.shadow_tables:
             raise Exception("Shadow table not yet geristered")
         if shadow_table.page_id == []:
             # attach a new shadow page
@@ -95,11 +113,11 @@ class Transaction:
     def drop_table_by_name(self, name: str):
         table: Table | ShadowTable = self.get_table_by_name(name)
         self.freed_page_ids += table.page_id  # free all pages
-        self.shadow_tables[table.table_name] = None  # remove the referenced
+        self.shadow_tables[table.table_name.lower()] = None  # remove the referenced
 
     def get_page_generator_from_table_by_name(self, name):
         table: ShadowTable | Table = self.get_table_by_name(name)
-        yield from self.buffer_manager.get_pages(table.page_id)
+        yield from _read_pages(self.catalog, self.buffer_manager, tuple(table.page_id))
 
 
     def _get_existing_page_for_write(self, shadow_table: ShadowTable, old_pid) -> ShadowPage:
@@ -109,10 +127,15 @@ class Transaction:
         """
         # get the original page
         original_page: Page | ShadowPage = self.buffer_manager.get_page(old_pid)
-        # get new page_id for the shadow
-        if isinstance(original_page, ShadowPage):
-            return original_page
-        if shadow_table.table_name not in self.shadow_tables:
+        if old_pid in self.obtained_page_ids:
+            # a page of this transaction, it can be changed in place. Committed pages stay in the buffer
+            # as shadow pages too, those are still read by others and are copied like any other page
+            if isinstance(original_page, ShadowPage):
+                return original_page
+            shadow_page = original_page.to_shadow_page(old_pid)  # it was written to disk and read back
+            self.buffer_manager.put(shadow_page)
+            return shadow_page
+        if shadow_table.table_name.lower() not in self.shadow_tables:
             raise Exception("Shadow table has not yet been registered")
 
         shadow_pid: int = self._get_free_page_id()
@@ -133,7 +156,7 @@ class Transaction:
         """
         Allocates a brand new 'orphan' page for a table.
         """
-        if shadow_table.table_name not in self.shadow_tables:
+        if shadow_table.table_name.lower() not in self.shadow_tables:
             raise Exception("Shadow table has not yet been registered")
         # get new page_id
         new_pid = self._get_free_page_id()
@@ -173,3 +196,45 @@ class Transaction:
         as free page ids."""
         self.catalog.return_page_ids(list(self.obtained_page_ids))
         self._has_terminated = True
+
+
+class ReadOnlyTransaction:
+    """Stand in for a Transaction when an auto commit SELECT is executed. begin takes the committed
+    version of the tables from the catalog. The page_ids of every table it resolves are held in the
+    catalog until it ends, a commit meanwhile can not hand them out again and committed pages are
+    never changed in place (changes go to shadow pages), so it reads a consistent snapshot. There is
+    nothing to undo or to publish, commit and rollback only release the page_ids. One instance is
+    reused by the SELECTs that are done within execute, a streaming SELECT gets its own."""
+    def __init__(self, buffer_manager, catalog):
+        self.id = -1
+        self.buffer_manager: BufferManager = buffer_manager
+        self.catalog: Catalog = catalog
+        self.tables: dict[str, Table] = {}
+        self._held_page_ids: dict[str, tuple[int, ...]] = {}  # table name: page_ids held in the catalog
+
+    def begin(self):
+        self.tables = dict(self.catalog.tables)
+
+    def get_table_by_name(self, name: str) -> Table:
+        table = self.tables.get(name)
+        if table is None:
+            name = name.lower()
+            table = self.tables.get(name)
+        if table is None:
+            raise Exception("Table not found")
+        if name not in self._held_page_ids:
+            self.catalog.hold_page_ids(table.page_id)
+            self._held_page_ids[name] = table.page_id
+        return table
+
+    def get_page_generator_from_table_by_name(self, name):
+        table: Table = self.get_table_by_name(name)
+        yield from self.buffer_manager.get_pages(table.page_id)  # held until the transaction ends
+
+    def commit(self):
+        for page_ids in self._held_page_ids.values():
+            self.catalog.release_page_ids(page_ids)
+        self._held_page_ids = {}
+
+    def rollback(self):
+        self.commit()